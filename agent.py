@@ -5,18 +5,50 @@ from dotenv import load_dotenv
 load_dotenv()
 
 import json
+import logging
+import re
+import sys
+from bisect import bisect_right
+from collections import OrderedDict
+from decimal import Decimal
+from functools import cache, lru_cache
+from itertools import combinations
+from threading import Lock
+from time import monotonic
+import numpy as np
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_groq import ChatGroq
 from langchain_core.output_parsers import StrOutputParser
-from typing import Dict, Any, Tuple, List
-from datetime import datetime, timedelta
+from typing import Dict, Any, Tuple, List, FrozenSet, NamedTuple, Optional
+from datetime import date, datetime
 from dateutil.relativedelta import relativedelta
  
-from db import semantic_search_sql, execute_sql_query_from_string, get_query_by_id
+from db import semantic_search_sql, execute_sql_query_from_string, get_query_by_id, ROUTER_RULES
 from schemas.state import ChatState
+from schemas.dates import calculate_date_from_placeholder, get_date_context
+
+logger = logging.getLogger(__name__)
 
 
 # --- Currency Formatting Utilities (CRITICAL for accurate financial reporting) ---
+CURRENCY_SYMBOL = "₹"
+
+# Magnitude buckets, precomputed once: bisect the absolute amount against the
+# thresholds and index straight into (divisor, suffix) instead of an if/elif ladder
+CURRENCY_THRESHOLDS = (1_000, 100_000, 10_000_000)
+CURRENCY_BUCKETS = (
+    (1, ""),              # < 1,000: Show as is
+    (1_000, " K"),        # >= 1,000: Thousands
+    (100_000, " L"),      # >= 1 Lakh (100 thousand)
+    (10_000_000, " Cr"),  # >= 1 Crore (10 million)
+)
+CURRENCY_DIVISORS = np.array([divisor for divisor, _ in CURRENCY_BUCKETS], dtype=np.float64)
+CURRENCY_SUFFIXES = np.array([suffix for _, suffix in CURRENCY_BUCKETS])
+
+# Row count from which preformat_currency_in_rows switches to the NumPy path
+VECTORIZE_MIN_ROWS = 64
+
+
 def format_indian_currency(amount) -> str:
     """
     Formats a numeric amount into Indian currency format.
@@ -38,43 +70,93 @@ def format_indian_currency(amount) -> str:
     if amount is None:
         return "N/A"
     
+    # Integer fast path: DB sums are mostly ints, skip the float round-trip
+    if isinstance(amount, int):
+        return _format_int_amount(amount)
+    
     try:
-        amount = float(amount)
+        value = float(amount)
     except (ValueError, TypeError):
         return str(amount)
     
-    # Handle negative amounts
-    is_negative = amount < 0
-    abs_amount = abs(amount)
+    return _format_float_amount(value)
+
+
+def _bucket_and_scale(amount: float) -> Tuple[int, float, bool]:
+    """
+    Numeric kernel of the formatter: (bucket index, scaled absolute value, is_negative).
+    Kept free of strings so the arithmetic stays separate from text assembly.
+    """
+    abs_amount, is_negative = (-amount, True) if amount < 0 else (amount, False)
+    bucket = bisect_right(CURRENCY_THRESHOLDS, abs_amount)
+    return bucket, abs_amount / CURRENCY_BUCKETS[bucket][0], is_negative
+
+
+def _bucket_and_scale_column(column: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Array form of _bucket_and_scale over a float64 column."""
+    abs_column = np.abs(column)
+    bucket = np.digitize(abs_column, CURRENCY_THRESHOLDS)
+    return bucket, abs_column / CURRENCY_DIVISORS[bucket], column < 0
+
+
+@lru_cache(maxsize=8192)
+def _format_float_amount(amount: float) -> str:
+    """
+    Cached core of format_indian_currency.
+    Result sets repeat values (zeros, shared subtotals), so identical amounts
+    are formatted once per process. Keyed on the exact float so output never drifts.
+    """
+    bucket, formatted, is_negative = _bucket_and_scale(amount)
     prefix = "-" if is_negative else ""
+    suffix = CURRENCY_BUCKETS[bucket][1]
     
-    # Convert based on magnitude
-    if abs_amount >= 10_000_000:  # 1 Crore = 10 million
-        formatted = abs_amount / 10_000_000
-        if formatted == int(formatted):
-            return f"{prefix}₹{int(formatted)} Cr"
-        else:
-            return f"{prefix}₹{formatted:.2f}".rstrip('0').rstrip('.') + " Cr"
-    
-    elif abs_amount >= 100_000:  # 1 Lakh = 100 thousand
-        formatted = abs_amount / 100_000
-        if formatted == int(formatted):
-            return f"{prefix}₹{int(formatted)} L"
-        else:
-            return f"{prefix}₹{formatted:.2f}".rstrip('0').rstrip('.') + " L"
-    
-    elif abs_amount >= 1_000:  # Thousands
-        formatted = abs_amount / 1_000
-        if formatted == int(formatted):
-            return f"{prefix}₹{int(formatted)} K"
-        else:
-            return f"{prefix}₹{formatted:.2f}".rstrip('0').rstrip('.') + " K"
+    if formatted == int(formatted):
+        return f"{prefix}{CURRENCY_SYMBOL}{int(formatted)}{suffix}"
+    # Strip only the ASCII number, then assemble once. Two-step strip on purpose:
+    # a single rstrip('0.') would turn "10.00" into "1", and '%g' loses digits past 6
+    number = f"{formatted:.2f}".rstrip('0').rstrip('.')
+    return f"{prefix}{CURRENCY_SYMBOL}{number}{suffix}"
+
+
+# Keywords that indicate a column contains currency/financial values
+CURRENCY_KEYWORDS = frozenset({
+    'sales', 'value', 'amount', 'total', 'revenue', 'invoice', 
+    'price', 'cost', 'sum', 'quantity_value', 'lineamount'
+})
+
+# Cell types (matched by exact type) that the NumPy column path accepts;
+# pyodbc returns DECIMAL/NUMERIC columns as Decimal
+CURRENCY_NUMERIC_TYPES = frozenset({int, float, Decimal})
+
+
+@lru_cache(maxsize=256)
+def _currency_column_indices(columns: Tuple[str, ...]) -> Tuple[int, ...]:
+    """
+    Finds indices of columns that likely contain currency values.
+    Cached per schema: follow-ups re-run the same query template, so the
+    column names repeat across turns.
+    """
+    return tuple(
+        idx for idx, col_name in enumerate(columns)
+        if any(keyword in col_name.lower() for keyword in CURRENCY_KEYWORDS)
+    )
+
+
+@lru_cache(maxsize=8192)
+def _format_int_amount(amount: int) -> str:
+    """
+    Integer variant of _format_float_amount.
+    divmod decides whole-number output exactly; only amounts with a remainder
+    take one true division for the two-decimal text.
+    """
+    prefix, abs_amount = ("-", -amount) if amount < 0 else ("", amount)
     
-    else:
-        if abs_amount == int(abs_amount):
-            return f"{prefix}₹{int(abs_amount)}"
-        else:
-            return f"{prefix}₹{abs_amount:.2f}".rstrip('0').rstrip('.')
+    divisor, suffix = CURRENCY_BUCKETS[bisect_right(CURRENCY_THRESHOLDS, abs_amount)]
+    whole, remainder = divmod(abs_amount, divisor)
+    if not remainder:
+        return f"{prefix}{CURRENCY_SYMBOL}{whole}{suffix}"
+    number = f"{abs_amount / divisor:.2f}".rstrip('0').rstrip('.')
+    return f"{prefix}{CURRENCY_SYMBOL}{number}{suffix}"
 
 
 def preformat_currency_in_rows(columns: List[str], rows: List[List]) -> List[List]:
@@ -82,127 +164,297 @@ def preformat_currency_in_rows(columns: List[str], rows: List[List]) -> List[Lis
     Pre-formats currency values in the rows data before sending to LLM.
     This is CRITICAL for accurate financial reporting.
     """
-    # Keywords that indicate a column contains currency/financial values
-    currency_keywords = {
-        'sales', 'value', 'amount', 'total', 'revenue', 'invoice', 
-        'price', 'cost', 'sum', 'quantity_value', 'lineamount'
-    }
-    
-    # Find indices of columns that likely contain currency values
-    currency_column_indices = []
-    for idx, col_name in enumerate(columns):
-        col_lower = col_name.lower()
-        if any(keyword in col_lower for keyword in currency_keywords):
-            currency_column_indices.append(idx)
+    currency_column_indices = _currency_column_indices(tuple(columns))
     
     if not currency_column_indices:
         return rows  # No currency columns found
     
-    # Format currency values
-    formatted_rows = []
-    for row in rows:
-        new_row = list(row)
-        for idx in currency_column_indices:
-            if idx < len(new_row):
-                value = new_row[idx]
-                if isinstance(value, (int, float)) and abs(value) >= 1000:
-                    new_row[idx] = format_indian_currency(value)
-        formatted_rows.append(new_row)
+    if not _has_large_currency_value(rows, currency_column_indices):
+        return rows  # Nothing reaches ₹1,000, so nothing would be rewritten
     
-    return formatted_rows
-
-
-# --- Query Variant Mapping (for dynamic switching) ---
-QUERY_VARIANTS = {
-    # filtered → base (when user says "all")
-    "product_segment_domestic_by_category": "product_segment_domestic",
-    "product_segment_export_by_category": "product_segment_export",
-    "cso_category_performance": "sales_performance_by_cso",
-    "cso_category_performance_export": "sales_performance_by_cso",
-    "state_category_performance": "sales_performance_by_state",
-    "state_category_performance_export": "sales_performance_by_state",
-    # domestic → export (when user says "export")
-    "product_segment_domestic|export": "product_segment_export",
-    "product_segment_domestic_by_category|export": "product_segment_export_by_category",
-    "cso_category_performance|export": "cso_category_performance_export",
-    "state_category_performance|export": "state_category_performance_export",
-    # base → category+export (when user adds category + export to base query)
-    "sales_performance_by_cso|export": "cso_category_performance_export",
-    "sales_performance_by_state|export": "state_category_performance_export",
-    # export → domestic (when user says "domestic")
-    "product_segment_export|domestic": "product_segment_domestic",
-    "product_segment_export_by_category|domestic": "product_segment_domestic_by_category",
-    "cso_category_performance_export|domestic": "cso_category_performance",
-    "state_category_performance_export|domestic": "state_category_performance",
-}
-
-# --- Query Upgrades (when filter is added to base query) ---
-# Maps (base_query, filter_type) to upgraded query
-# This ensures product queries stay as product queries when filters are added
-QUERY_UPGRADES = {
-    # Product segment + category → Product segment by category
-    "product_segment_domestic|business_category": "product_segment_domestic_by_category",
-    "product_segment_export|business_category": "product_segment_export_by_category",
+    # Copy-on-write: the caller keeps the raw rows (chat_state.last_rows feeds
+    # TABLE mode), so a list row is only copied once one of its cells changes.
+    # Non-list rows are converted up front, as before.
+    formatted_rows = [row if isinstance(row, list) else list(row) for row in rows]
     
-    # Base salesperson + category → Category performance
-    "top_salesperson_flexible_period|business_category": "general_category_performance",
-    "executive_sales_performance_period|business_category": "general_category_performance",
+    # Small result sets: scalar path (NumPy setup costs more than it saves)
+    if len(formatted_rows) < VECTORIZE_MIN_ROWS:
+        for pos, row in enumerate(formatted_rows):
+            for idx in currency_column_indices:
+                if idx < len(row):
+                    value = row[idx]
+                    value_type = type(value)
+                    if value_type is int:
+                        if value >= 1000 or value <= -1000:
+                            _writable_row(formatted_rows, rows, pos)[idx] = _format_int_amount(value)
+                    elif value_type is float:
+                        if value >= 1000 or value <= -1000:
+                            _writable_row(formatted_rows, rows, pos)[idx] = _format_float_amount(value)
+                    elif value_type is Decimal and value.is_finite() and abs(value) >= 1000:
+                        _writable_row(formatted_rows, rows, pos)[idx] = _format_float_amount(float(value))
+        return formatted_rows
     
-    # Base salesperson + state → State performance
-    "top_salesperson_flexible_period|state_id": "sales_performance_by_state",
-    "executive_sales_performance_period|state_id": "sales_performance_by_state",
-    
-    # State performance + category → State category performance
-    "sales_performance_by_state|business_category": "state_category_performance",
+    # Large result sets: format each currency column as one NumPy array
+    for idx in currency_column_indices:
+        positions = [pos for pos, row in enumerate(formatted_rows) if idx < len(row)]
+        values = [formatted_rows[pos][idx] for pos in positions]
+        
+        if all(type(value) in CURRENCY_NUMERIC_TYPES for value in values):
+            column = np.fromiter(values, dtype=np.float64, count=len(values))
+            if np.isfinite(column).all():
+                for pos, value, new_value in zip(positions, values, _format_currency_column(column, values)):
+                    if new_value is not value:
+                        _writable_row(formatted_rows, rows, pos)[idx] = new_value
+                continue
+        
+        # Mixed-type or non-finite column: fall back to the scalar path
+        for pos, value in zip(positions, values):
+            value_type = type(value)
+            if value_type is int:
+                if value >= 1000 or value <= -1000:
+                    _writable_row(formatted_rows, rows, pos)[idx] = _format_int_amount(value)
+            elif value_type is float:
+                if value >= 1000 or value <= -1000:
+                    _writable_row(formatted_rows, rows, pos)[idx] = _format_float_amount(value)
+            elif value_type is Decimal and value.is_finite() and abs(value) >= 1000:
+                _writable_row(formatted_rows, rows, pos)[idx] = _format_float_amount(float(value))
     
-    # Base salesperson + cso → CSO performance
-    "top_salesperson_flexible_period|cso_id": "sales_performance_by_cso",
-    "executive_sales_performance_period|cso_id": "sales_performance_by_cso",
+    return formatted_rows
+
+
+def _has_large_currency_value(rows: List[List], currency_column_indices: Tuple[int, ...]) -> bool:
+    """
+    True if any currency cell would be formatted (|value| >= 1000).
+    Stops at the first hit, so the usual case costs only a few cells.
+    """
+    for row in rows:
+        for idx in currency_column_indices:
+            if idx < len(row):
+                value = row[idx]
+                value_type = type(value)
+                if value_type is int or value_type is float:
+                    if value >= 1000 or value <= -1000:
+                        return True
+                elif value_type is Decimal and value.is_finite() and abs(value) >= 1000:
+                    return True
+    return False
+
+
+def _writable_row(formatted_rows: List[List], rows: List[List], pos: int) -> List:
+    """Returns formatted_rows[pos], copying it first if it is still the caller's row."""
+    row = formatted_rows[pos]
+    if row is rows[pos]:
+        row = formatted_rows[pos] = list(row)
+    return row
+
+
+def _format_currency_column(column: np.ndarray, values: List[Any]) -> List[Any]:
+    """
+    Vectorized format_indian_currency over one finite float64 column.
+    Cells below 1,000 are returned untouched, matching the scalar path.
+    """
+    bucket, scaled, is_negative = _bucket_and_scale_column(column)
     
-    # CSO performance + category → CSO category performance
-    "sales_performance_by_cso|business_category": "cso_category_performance",
+    whole = np.char.mod("%d", scaled)
+    decimal = np.char.rstrip(np.char.rstrip(np.char.mod("%.2f", scaled), "0"), ".")
+    body = np.where(scaled == np.floor(scaled), whole, decimal)
     
-    # Category performance + state → State category performance
-    "general_category_performance|state_id": "state_category_performance",
+    prefix = np.where(is_negative, "-" + CURRENCY_SYMBOL, CURRENCY_SYMBOL)
+    text = np.char.add(np.char.add(prefix, body), CURRENCY_SUFFIXES[bucket])
     
-    # Category performance + cso → CSO category performance  
-    "general_category_performance|cso_id": "cso_category_performance",
-}
-
-# --- Query Parameter Support Config ---
-# Maps each query ID to the set of filter params it supports
-# This enables automatic query selection based on collected parameters
-QUERY_SUPPORTED_PARAMS = {
-    # Base queries (no filters)
-    "top_salesperson_flexible_period": {"start_date", "end_date", "sort", "n"},
-    "executive_sales_performance_period": {"start_date", "end_date", "sort", "n"},
-    # "monthly_sales_breakdown": {"business_category", "start_date", "end_date"},
+    return [
+        formatted if is_large else value
+        for formatted, is_large, value in zip(text.tolist(), (bucket > 0).tolist(), values)
+    ]
+
+
+# --- Query Routing Spec ---
+# One entry per query template. QUERY_SUPPORTED_PARAMS, QUERY_VARIANTS_FILTER,
+# QUERY_VARIANTS_MODE and QUERY_UPGRADES are all derived from QUERY_SPECS at
+# import, so a template is described in exactly one place.
+class QuerySpec(NamedTuple):
+    id: str
+    params: FrozenSet[str]                      # Params the SQL template accepts
+    mode: Optional[str] = None                  # "domestic" / "export" if the template is mode-specific
+    export_variant: Optional[str] = None        # Switch target when the user says "export"
+    base: Optional[str] = None                  # Unfiltered query when the user says "all"
+    upgrades: Tuple[Tuple[str, str], ...] = ()  # (filter param, upgraded query), checked in order
+
+
+PERIOD_PARAMS = frozenset({"start_date", "end_date"})
+RANKED_PERIOD_PARAMS = PERIOD_PARAMS | {"sort", "n"}
+
+# Order matters: ties in find_best_query_for_params go to the earlier entry
+QUERY_SPECS = (
+    # Base queries (no filters); a category/state/cso filter upgrades them
+    QuerySpec(
+        "top_salesperson_flexible_period", RANKED_PERIOD_PARAMS,
+        upgrades=(
+            ("business_category", "general_category_performance"),
+            ("state_id", "sales_performance_by_state"),
+            ("cso_id", "sales_performance_by_cso"),
+        ),
+    ),
+    QuerySpec(
+        "executive_sales_performance_period", RANKED_PERIOD_PARAMS,
+        upgrades=(
+            ("business_category", "general_category_performance"),
+            ("state_id", "sales_performance_by_state"),
+            ("cso_id", "sales_performance_by_cso"),
+        ),
+    ),
+    # QuerySpec("monthly_sales_breakdown", PERIOD_PARAMS | {"business_category"}),
     
     # Single filter queries
-    "sales_performance_by_state": {"state_id", "start_date", "end_date", "sort", "n"},
-    "sales_performance_by_cso": {"cso_id", "start_date", "end_date", "sort", "n"},
-    "sales_performance_by_cluster": {"cluster_id", "sort", "n"},
-    "general_category_performance": {"business_category", "start_date", "end_date", "sort", "n"},
-    "domestic_category_specific": {"business_category", "start_date", "end_date", "sort", "n"},
-    "export_category_specific": {"business_category", "start_date", "end_date", "sort", "n"},
+    QuerySpec(
+        "sales_performance_by_state", RANKED_PERIOD_PARAMS | {"state_id"},
+        export_variant="state_category_performance_export",
+        upgrades=(("business_category", "state_category_performance"),),
+    ),
+    QuerySpec(
+        "sales_performance_by_cso", RANKED_PERIOD_PARAMS | {"cso_id"},
+        export_variant="cso_category_performance_export",
+        upgrades=(("business_category", "cso_category_performance"),),
+    ),
+    QuerySpec("sales_performance_by_cluster", frozenset({"cluster_id", "sort", "n"})),
+    QuerySpec(
+        "general_category_performance", RANKED_PERIOD_PARAMS | {"business_category"},
+        upgrades=(
+            ("state_id", "state_category_performance"),
+            ("cso_id", "cso_category_performance"),
+        ),
+    ),
+    QuerySpec("domestic_category_specific", RANKED_PERIOD_PARAMS | {"business_category"}, mode="domestic"),
+    QuerySpec("export_category_specific", RANKED_PERIOD_PARAMS | {"business_category"}, mode="export"),
     
     # Combined filter queries (state + category)
-    "state_category_performance": {"state_id", "business_category", "start_date", "end_date", "sort", "n"},
-    "state_category_performance_export": {"state_id", "business_category", "start_date", "end_date", "sort", "n"},
+    QuerySpec(
+        "state_category_performance", RANKED_PERIOD_PARAMS | {"state_id", "business_category"},
+        mode="domestic", export_variant="state_category_performance_export",
+        base="sales_performance_by_state",
+    ),
+    QuerySpec(
+        "state_category_performance_export", RANKED_PERIOD_PARAMS | {"state_id", "business_category"},
+        mode="export", base="sales_performance_by_state",
+    ),
     
     # Combined filter queries (cso + category)
-    "cso_category_performance": {"cso_id", "business_category", "start_date", "end_date", "sort", "n"},
-    "cso_category_performance_export": {"cso_id", "business_category", "start_date", "end_date", "sort", "n"},
+    QuerySpec(
+        "cso_category_performance", RANKED_PERIOD_PARAMS | {"cso_id", "business_category"},
+        mode="domestic", export_variant="cso_category_performance_export",
+        base="sales_performance_by_cso",
+    ),
+    QuerySpec(
+        "cso_category_performance_export", RANKED_PERIOD_PARAMS | {"cso_id", "business_category"},
+        mode="export", base="sales_performance_by_cso",
+    ),
     
-    # Product segment queries
-    "product_segment_domestic": {"start_date", "end_date"},
-    "product_segment_domestic_by_category": {"business_category", "start_date", "end_date"},
-    "product_segment_export": {"start_date", "end_date"},
-    "product_segment_export_by_category": {"business_category", "start_date", "end_date"},
+    # Product segment queries (no sort/n)
+    QuerySpec(
+        "product_segment_domestic", PERIOD_PARAMS,
+        mode="domestic", export_variant="product_segment_export",
+        upgrades=(("business_category", "product_segment_domestic_by_category"),),
+    ),
+    QuerySpec(
+        "product_segment_domestic_by_category", PERIOD_PARAMS | {"business_category"},
+        mode="domestic", export_variant="product_segment_export_by_category",
+        base="product_segment_domestic",
+    ),
+    QuerySpec(
+        "product_segment_export", PERIOD_PARAMS,
+        mode="export",
+        upgrades=(("business_category", "product_segment_export_by_category"),),
+    ),
+    QuerySpec(
+        "product_segment_export_by_category", PERIOD_PARAMS | {"business_category"},
+        mode="export", base="product_segment_export",
+    ),
+)
+
+# --- Query Parameter Support Config ---
+# Maps each query ID to the set of params it supports
+# This enables automatic query selection based on collected parameters
+QUERY_SUPPORTED_PARAMS = {spec.id: spec.params for spec in QUERY_SPECS}
+
+# --- Query Variant Mapping (for dynamic switching) ---
+# filtered → base (when user says "all")
+QUERY_VARIANTS_FILTER = {spec.id: spec.base for spec in QUERY_SPECS if spec.base}
+
+# Maps query_id → {sales mode: switched query_id}
+# "export" comes straight from the spec; "domestic" is its reverse, taken
+# from mode-specific domestic queries only (base queries have no domestic twin)
+QUERY_VARIANTS_MODE: Dict[str, Dict[str, str]] = {}
+for spec in QUERY_SPECS:
+    if spec.export_variant:
+        QUERY_VARIANTS_MODE.setdefault(spec.id, {})["export"] = spec.export_variant
+        if spec.mode == "domestic":
+            QUERY_VARIANTS_MODE.setdefault(spec.export_variant, {})["domestic"] = spec.id
+
+# --- Query Upgrades (when filter is added to base query) ---
+# Maps base_query → {filter_type: upgraded query}
+# This ensures product queries stay as product queries when filters are added
+QUERY_UPGRADES = {spec.id: dict(spec.upgrades) for spec in QUERY_SPECS if spec.upgrades}
+
+_unknown_query_ids = {
+    query_id
+    for spec in QUERY_SPECS
+    for query_id in (spec.export_variant, spec.base, *(upgraded for _, upgraded in spec.upgrades))
+    if query_id and query_id not in QUERY_SUPPORTED_PARAMS
 }
+if _unknown_query_ids:
+    raise ValueError(f"QUERY_SPECS references unknown query IDs: {sorted(_unknown_query_ids)}")
 
 # Filter params that require query switching (location/category filters)
-FILTER_PARAMS = {"state_id", "cso_id", "cluster_id", "business_category"}
+FILTER_PARAMS = frozenset({"state_id", "cso_id", "cluster_id", "business_category"})
+
+# --- Bitmask encoding of parameter support ---
+# Each param name is one bit; a query's supported set is one int, so subset
+# tests in find_best_query_for_params are a single AND instead of set ops
+PARAM_BITS = {
+    name: 1 << i
+    for i, name in enumerate(sorted(set().union(*QUERY_SUPPORTED_PARAMS.values())))
+}
+FILTER_BITS = {name: PARAM_BITS[name] for name in sorted(FILTER_PARAMS)}
+FILTER_MASK = sum(FILTER_BITS.values())
+
+QUERY_SUPPORTED_MASK = {
+    qid: sum(PARAM_BITS[p] for p in params)
+    for qid, params in QUERY_SUPPORTED_PARAMS.items()
+}
+# How many filter params each query supports
+QUERY_FILTER_COUNT = {qid: (mask & FILTER_MASK).bit_count() for qid, mask in QUERY_SUPPORTED_MASK.items()}
+
+# Export-variant query IDs (plain membership test, no .lower() scans)
+EXPORT_QUERY_IDS = frozenset(spec.id for spec in QUERY_SPECS if spec.mode == "export")
+
+
+def _build_route_table() -> Dict[int, Tuple[str, str]]:
+    """
+    Precomputes the PRIORITY 3 answer of find_best_query_for_params for every
+    subset of FILTER_PARAMS (only 16 of them), so routing is one dict lookup.
+    Maps filter mask → (best query, best export query); either may be None.
+    """
+    route_table = {}
+    for size in range(len(FILTER_BITS) + 1):
+        for subset in combinations(FILTER_BITS.values(), size):
+            user_mask = sum(subset)
+            best = best_export = None
+            best_extra = best_export_extra = len(FILTER_BITS) + 1
+            
+            # Strict < keeps the first of equal scores, i.e. QUERY_SPECS order
+            for qid, supported_mask in QUERY_SUPPORTED_MASK.items():
+                if supported_mask & user_mask != user_mask:
+                    continue
+                extra = QUERY_FILTER_COUNT[qid] - size
+                if extra < best_extra:
+                    best, best_extra = qid, extra
+                if extra < best_export_extra and qid in EXPORT_QUERY_IDS:
+                    best_export, best_export_extra = qid, extra
+            route_table[user_mask] = (best, best_export)
+    return route_table
+
+
+QUERY_ROUTE_TABLE = _build_route_table()
 
 
 def find_best_query_for_params(collected_params: dict, current_query_id: str = None) -> str:
@@ -219,69 +471,96 @@ def find_best_query_for_params(collected_params: dict, current_query_id: str = N
     Returns:
         Query ID that supports all filters, or current_query_id if none found
     """
-    # Get filter params that user has provided
-    user_filters = set(collected_params.keys()) & FILTER_PARAMS
+    # Get filter params that user has provided, as a bitmask
+    user_mask = 0
+    for filter_param, bit in FILTER_BITS.items():
+        if filter_param in collected_params:
+            user_mask |= bit
     
-    if not user_filters:
+    if not user_mask:
         return current_query_id  # No filter params, keep current query
     
     # PRIORITY 1: Check QUERY_UPGRADES for explicit type-preserving mappings
     # This ensures product queries stay as product queries, etc.
-    if current_query_id:
-        for filter_param in user_filters:
-            upgrade_key = f"{current_query_id}|{filter_param}"
-            if upgrade_key in QUERY_UPGRADES:
-                upgraded_query = QUERY_UPGRADES[upgrade_key]
-                print(f"[DEBUG] UPGRADE: '{current_query_id}' + {filter_param} → '{upgraded_query}'")
+    upgrades = QUERY_UPGRADES.get(current_query_id) if current_query_id else None
+    if upgrades:
+        # Walk the upgrade table (not the filters) so the pick is deterministic across runs
+        for filter_param, upgraded_query in upgrades.items():
+            if FILTER_BITS[filter_param] & user_mask:
+                logger.debug("UPGRADE: '%s' + %s → '%s'", current_query_id, filter_param, upgraded_query)
                 return upgraded_query
     
     # PRIORITY 2: Check if current query already supports all filters
-    if current_query_id and current_query_id in QUERY_SUPPORTED_PARAMS:
-        current_supported = QUERY_SUPPORTED_PARAMS[current_query_id]
-        if user_filters.issubset(current_supported):
-            # Current query already works
-            return current_query_id
+    current_mask = QUERY_SUPPORTED_MASK.get(current_query_id) if current_query_id else None
+    if current_mask is not None and current_mask & user_mask == user_mask:
+        # Current query already works
+        return current_query_id
     
-    # PRIORITY 3: Find any query that supports all user's filters
-    candidates = []
-    for qid, supported in QUERY_SUPPORTED_PARAMS.items():
-        if user_filters.issubset(supported):
-            # Score by how many extra params it supports (prefer simpler queries)
-            extra_filters = len(supported & FILTER_PARAMS) - len(user_filters)
-            candidates.append((qid, extra_filters))
+    # PRIORITY 3: Find any query that supports all user's filters (precomputed)
+    best, best_export = QUERY_ROUTE_TABLE[user_mask]
     
-    if candidates:
+    if best:
         # Check if export is requested
-        is_export = (current_query_id and 'export' in current_query_id.lower()) or \
-                    collected_params.get('sales_type') == 'export'
+        is_export = current_query_id in EXPORT_QUERY_IDS or collected_params.get('sales_type') == 'export'
         
-        if is_export:
-            # Prefer queries with 'export' in the name
-            export_candidates = [(qid, score) for qid, score in candidates if 'export' in qid.lower()]
-            if export_candidates:
-                best = min(export_candidates, key=lambda x: x[1])
-                return best[0]
+        # Prefer queries with 'export' in the name
+        if is_export and best_export:
+            return best_export
         
         # Return query with fewest extra filter params (most specific match)
-        best = min(candidates, key=lambda x: x[1])
-        return best[0]
+        return best
     
     return current_query_id  # No match found, keep current
 
  
 # --- Configuration ---
-LLM = ChatGroq(
-    temperature=0.0,
-    groq_api_key=os.getenv("GROQ_API_KEY"),
-    model_name="moonshotai/kimi-k2-instruct-0905"
-)
+@cache
+def get_llm() -> ChatGroq:
+    """Shared Groq chat model, created on the first LLM call rather than at import."""
+    return ChatGroq(
+        temperature=0.0,
+        groq_api_key=os.getenv("GROQ_API_KEY"),
+        model_name="moonshotai/kimi-k2-instruct-0905"
+    )
+
 DOMAIN_DECLINE_MESSAGE = "I am a sales data assistant. How can I assist you with a sales data query?"
  
  
+class LRUCache:
+    """
+    Small thread-safe LRU map (teams_C runs turns on worker threads).
+    Entries older than ttl seconds, if given, count as misses.
+    """
+    
+    def __init__(self, maxsize: int, ttl: Optional[float] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: "OrderedDict[Any, Tuple[float, Any]]" = OrderedDict()
+        self._lock = Lock()
+    
+    def get(self, key) -> Any:
+        """Returns the cached value, or None on a miss."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            stored_at, value = entry
+            if self.ttl is not None and monotonic() - stored_at > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+    
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (monotonic(), value)
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+
 # --- 1. Intent Router Logic ---
-INTENT_PROMPT = ChatPromptTemplate.from_messages([
-    ("system",
-     """
+INTENT_SYSTEM_PROMPT = """
      You are an intent router. Analyze the user's question and output ONE keyword only.
      
      **OUTPUT KEYWORDS (choose exactly one):**
@@ -297,17 +576,82 @@ INTENT_PROMPT = ChatPromptTemplate.from_messages([
      - Business categories like 'wiring', 'switches', 'cables', 'FMEG', 'export', 'domestic' → SALES
      - Any follow-up that mentions dates, categories, or filters → SALES
      """
-    ),
-    ("human", "{question}")
+
+
+@cache
+def get_intent_chain():
+    """Builds the intent router chain on first use."""
+    prompt = ChatPromptTemplate.from_messages([
+        ("system", INTENT_SYSTEM_PROMPT),
+        ("human", "{question}")
+    ])
+    return prompt | get_llm() | StrOutputParser()
+
+
+# Messages whose intent is unambiguous; these never reach the intent LLM
+GREETING_PHRASES = frozenset({
+    "hi", "hii", "hello", "hey", "hey there", "good morning", "good afternoon", "good evening"
+})
+TABLE_PHRASES = frozenset({
+    "table", "in table", "show table", "display table", "show in table", "as table", "in table format", "table format"
+})
+
+
+# Reset and goodbye keywords as whole words/phrases, matched against the lowercased message
+RESET_PATTERN = re.compile(r'\b(?:start over|reset|begin again|clear|new question|skip)\b')
+GOODBYE_PATTERN = re.compile(r'\b(?:bye|goodbye|see you|thanks bye|thank you bye|cya|later|take care)\b')
+
+
+
+def keyword_pattern(keywords: List[str]) -> "re.Pattern":
+    """One alternation that matches wherever any keyword occurs (same as `any(k in text)`)."""
+    return re.compile('|'.join(map(re.escape, keywords)))
+
+
+# Subject-switch and time keywords checked in run_sql_rag_agent (lowercased text)
+SALESPERSON_REQUEST_PATTERN = keyword_pattern(["salesperson", "who generated", "who made", "rank sales", "best performer", "top performer"])
+PRODUCT_REQUEST_PATTERN = keyword_pattern(["product type", "product segment", "which product"])
+SALESPERSON_QUERY_ID_PATTERN = keyword_pattern(["salesperson", "category_performance", "category_specific"])
+PERSON_WORDS_PATTERN = keyword_pattern(['who', 'salesperson', 'performer', 'executive', 'sales rep'])
+ORDINAL_PATTERN = re.compile(r'\b\d+(?:st|nd|rd|th)\b')  # Matches 1st, 2nd, 3rd, 4th, 5th, etc.
+EXPLICIT_TIME_PATTERN = keyword_pattern([
+    'last month', 'last year', 'last quarter', 'this month', 'this year',
+    'previous month', 'previous year', 'previous quarter',
+    'january', 'february', 'march', 'april', 'may', 'june',
+    'july', 'august', 'september', 'october', 'november', 'december'
 ])
-INTENT_CHAIN = INTENT_PROMPT | LLM | StrOutputParser()
+
+
+def normalize_question(question: str) -> str:
+    """Lowercases and collapses whitespace so repeated messages share one cache key."""
+    return " ".join(question.lower().split())
+
+
+# Intent verdicts keyed on the normalized message
+INTENT_CACHE = LRUCache(maxsize=1024)
+
+
+def classify_intent(question: str, normalized_question: str) -> str:
+    """
+    Returns the intent keyword for a message.
+    Intent depends only on the message text, so repeats ("ok", "top 5 sales
+    last month") are answered from the cache instead of another LLM call.
+    The cache is keyed on the normalized text; the LLM still sees the original message.
+    """
+    if normalized_question in GREETING_PHRASES:
+        return "GREETING"
+    if normalized_question in TABLE_PHRASES:
+        return "TABLE"
+    intent = INTENT_CACHE.get(normalized_question)
+    if intent is None:
+        intent = get_intent_chain().invoke({"question": question}).strip().upper()
+        INTENT_CACHE.put(normalized_question, intent)
+    return intent
  
 
 
 # --- 2. Context Analyzer Chain (For Follow-up Detection & Parameter Inheritance) ---
-CONTEXT_PROMPT = ChatPromptTemplate.from_messages([
-    ("system",
-     """
+CONTEXT_SYSTEM_PROMPT = """
      You are a conversation context analyzer for a sales data chatbot.
      
      **CURRENT DATE: {current_date}**
@@ -451,25 +795,154 @@ CONTEXT_PROMPT = ChatPromptTemplate.from_messages([
          Current: "Which product type generated highest invoice value"
          → NEW_QUERY (NOT FOLLOW_UP! Subject changed from PERSON to PRODUCT)
       
+     **QUERY FAMILY (for FOLLOW_UP and NEW_QUERY):**
+     Label the CURRENT MESSAGE alone with one family: CSO, PRODUCT, EXPORT, DOMESTIC, STATE, CATEGORY, GENERAL
+{router_rules}
+     
      **OUTPUT FORMAT (JSON only, no extra text):**
      {{
        "query_type": "ACKNOWLEDGMENT" | "CLARIFICATION_QUESTION" | "FOLLOW_UP" | "NEW_QUERY" | "CLARIFICATION",
        "confidence": "HIGH" | "MEDIUM" | "LOW",
        "reasoning": "One line explanation",
+       "query_family": "CSO" | "PRODUCT" | "EXPORT" | "DOMESTIC" | "STATE" | "CATEGORY" | "GENERAL",
        "inherit_params": ["list", "of", "param", "names", "to", "carry", "forward"],
        "override_params": {{"param_name": "new_value_if_mentioned"}}
      }}
-     """
-    ),
-    ("human", "{current_message}")
-])
-CONTEXT_CHAIN = CONTEXT_PROMPT | LLM | StrOutputParser()
+     """.replace("{router_rules}", ROUTER_RULES)
+
+
+def context_messages(inputs: dict) -> list:
+    """
+    Fills CONTEXT_SYSTEM_PROMPT with a plain str.format_map pass.
+    (role, text) tuples go to the model as-is, skipping prompt-template parsing per turn.
+    """
+    return [
+        ("system", CONTEXT_SYSTEM_PROMPT.format_map(inputs)),
+        ("human", inputs["current_message"])
+    ]
+
+
+@cache
+def get_context_chain():
+    """Builds the context analyzer chain on first use."""
+    return context_messages | get_llm() | StrOutputParser()
+
+
+# Context analysis results, keyed on everything the classification depends on
+# except the free-text history (which changes every turn)
+CONTEXT_CACHE = LRUCache(maxsize=256)
+
+
+def analyze_context(context_input: dict, last_param_names: List[str]) -> dict:
+    """
+    Runs the context analyzer and parses its JSON verdict.
+    A repeated follow-up ("what about lowest") on the same last query, params
+    and day reuses the earlier verdict and skips the LLM call and JSON repair.
+    The returned dict may be shared with the cache; callers only read it.
+    """
+    key = (
+        context_input["last_query_id"],
+        context_input["last_question"],
+        context_input["last_params"],
+        normalize_question(context_input["current_message"]),
+        context_input["current_date"],
+    )
+    context_data = CONTEXT_CACHE.get(key)
+    if context_data is not None:
+        print(f"[DEBUG] Context analysis cache hit")
+        return context_data
+    
+    context_result = get_context_chain().invoke(context_input)
+    context_data = parse_context_result(context_result, last_param_names)
+    
+    # Empty means the reply could not be parsed; let the next identical turn retry
+    if context_data:
+        CONTEXT_CACHE.put(key, context_data)
+    return context_data
+
+
+# Repairs for malformed context-analyzer JSON (only used when raw_decode fails)
+JSON_DECODER = json.JSONDecoder()
+JSON_TRAILING_COMMA_PATTERN = re.compile(r',\s*([}\]])')
+JSON_MISSING_COMMA_PATTERN = re.compile(r'"\s+(")')
+JSON_UNQUOTED_VALUE_PATTERN = re.compile(r':\s*([A-Z_]+)(\s*[,}])')
+BRACE_PATTERN = re.compile(r'[{}]')
+
+
+def extract_json(text):
+    """
+    Extract first valid JSON object, handling nested braces.
+    Steps brace to brace with a regex instead of visiting every character.
+    """
+    start = text.find('{')
+    if start == -1:
+        return None
+    
+    depth = 0
+    for match in BRACE_PATTERN.finditer(text, start):
+        if match.group() == '{':
+            depth += 1
+        else:
+            depth -= 1
+            if depth == 0:
+                return text[start:match.end()]
+    return None
+
+
+def parse_context_result(context_result: str, last_param_names: List[str]) -> dict:
+    """
+    Robust JSON extraction from the context analyzer reply.
+    Falls back to a FOLLOW_UP verdict inheriting last_param_names when the reply
+    mentions FOLLOW_UP but is not valid JSON, else an empty dict.
+    """
+    # Fast path: well-formed JSON object, decoded in one C-level pass from the first '{'
+    start = context_result.find('{')
+    if start != -1:
+        try:
+            return JSON_DECODER.raw_decode(context_result, start)[0]
+        except json.JSONDecodeError:
+            pass
+    
+    json_str = extract_json(context_result)
+    if json_str:
+        # Clean up common JSON formatting issues from LLM
+        # Remove trailing commas before } or ]
+        json_str = JSON_TRAILING_COMMA_PATTERN.sub(r'\1', json_str)
+        # Add missing commas between "value" "key" patterns
+        json_str = JSON_MISSING_COMMA_PATTERN.sub(r'", \1', json_str)
+        # Fix unquoted values that should be strings
+        json_str = JSON_UNQUOTED_VALUE_PATTERN.sub(r': "\1"\2', json_str)
+        
+        try:
+            context_data = json.loads(json_str)
+        except json.JSONDecodeError:
+            # If still fails, try to extract key fields manually
+            context_data = {}
+            if '"FOLLOW_UP"' in json_str or "'FOLLOW_UP'" in json_str:
+                context_data['query_type'] = 'FOLLOW_UP'
+                context_data['confidence'] = 'HIGH'
+                # Inherit all previous params to maintain context
+                context_data['inherit_params'] = list(last_param_names)
+            print(f"[DEBUG] JSON cleanup failed, using fallback: {context_data}")
+    else:
+        # extract_json returned None - try parsing raw or fallback
+        try:
+            context_data = json.loads(context_result)
+        except json.JSONDecodeError:
+            # Check if it looks like a follow-up and inherit all params
+            context_data = {}
+            if 'FOLLOW_UP' in context_result.upper():
+                context_data['query_type'] = 'FOLLOW_UP'
+                context_data['confidence'] = 'HIGH'
+                context_data['inherit_params'] = list(last_param_names)
+                print(f"[DEBUG] Fallback FOLLOW_UP from raw response, inheriting: {context_data['inherit_params']}")
+            else:
+                print(f"[DEBUG] Could not parse context, treating as NEW_QUERY")
+    return context_data
 
 
 # --- 3. Enhanced Parameter Extraction (Context-Aware) ---
-PARAMETER_EXTRACTION_PROMPT = ChatPromptTemplate.from_messages([
-    ("system",
-     """
+PARAMETER_EXTRACTION_SYSTEM_PROMPT = """
      You are a parameter extractor for a Sales ERP system.
      
      **CONTEXT FROM CONVERSATION:**
@@ -530,10 +1003,20 @@ PARAMETER_EXTRACTION_PROMPT = ChatPromptTemplate.from_messages([
      Example (single): {{"n": 5, "sort": "DESC", "business_category": "'FMEG'"}}
       Example (multiple): {{"business_category": "'FMEG', 'Wires & Cables'"}}
      """
-    ),
-    ("human", "Current user message: {question}")
-])
-PARAMETER_EXTRACTION_CHAIN = PARAMETER_EXTRACTION_PROMPT | LLM | StrOutputParser()
+
+
+def parameter_extraction_messages(inputs: dict) -> list:
+    """Fills PARAMETER_EXTRACTION_SYSTEM_PROMPT the same way as context_messages."""
+    return [
+        ("system", PARAMETER_EXTRACTION_SYSTEM_PROMPT.format_map(inputs)),
+        ("human", f"Current user message: {inputs['question']}")
+    ]
+
+
+@cache
+def get_parameter_extraction_chain():
+    """Builds the parameter extraction chain on first use."""
+    return parameter_extraction_messages | get_llm() | StrOutputParser()
  
  
 # --- 3. Main RAG Prompt ---
@@ -670,11 +1153,6 @@ Query Context (IMPORTANT: Mention these filters naturally in your response - sta
  
 HUMAN_PROMPT = "Original question: {question}"
  
-AGENT_PROMPT = ChatPromptTemplate.from_messages([
-    ("system", SYSTEM_PROMPT),
-    ("human", HUMAN_PROMPT)
-])
- 
 def input_format(input_dict: dict) -> dict:
     return {
         "columns": input_dict.get("columns", "[]"),
@@ -682,77 +1160,79 @@ def input_format(input_dict: dict) -> dict:
         "question": input_dict["question"],
         "query_context": input_dict.get("query_context", "{}")
     }
+
+
+@cache
+def get_answer_chain():
+    """Builds the final answer chain on first use instead of once per turn."""
+    prompt = ChatPromptTemplate.from_messages([
+        ("system", SYSTEM_PROMPT),
+        ("human", HUMAN_PROMPT)
+    ])
+    return input_format | prompt | get_llm() | StrOutputParser()
+
+
+TABLE_SYSTEM_PROMPT = "Format the following data as a markdown table. Output ONLY the table. Keep numeric values exactly as provided."
+
+
+@cache
+def get_table_chain():
+    """Builds the markdown table chain on first use instead of once per request."""
+    prompt = ChatPromptTemplate.from_messages([
+        ("system", TABLE_SYSTEM_PROMPT),
+        ("human", "Columns: {columns}\nRows: {rows}")
+    ])
+    return prompt | get_llm() | StrOutputParser()
+
+
+def _prompt_cell(value: Any) -> str:
+    """repr() of one result cell, minus the constructor noise of non-JSON types."""
+    value_type = type(value)
+    if value_type is Decimal:
+        return str(value)  # 850.00, not Decimal('850.00')
+    if value_type is date or value_type is datetime:
+        return repr(value.isoformat())  # '2025-01-31', not datetime.date(2025, 1, 31)
+    return repr(value)
+
+
+def format_rows_for_prompt(rows: List[List]) -> str:
+    """
+    Renders rows in the same [['Name', 123], ...] shape as str(rows), which the
+    answer prompt's examples use, but with Decimal and date cells written as
+    plain values so they don't spend prompt tokens on their reprs.
+    """
+    return "[" + ", ".join("[" + ", ".join(map(_prompt_cell, row)) + "]" for row in rows) + "]"
  
  
 # --- 4. Helper Functions ---
  
+# User-friendly examples for each parameter type
+PARAMETER_GUIDANCE: Dict[str, str] = {
+    "n": "a number (e.g., 'top 5', 'best 10', or just '5')",
+    "sort": "sorting direction (e.g., 'highest', 'lowest', 'top', 'bottom')",
+    "start_date": "start date (e.g., 'last month', 'January 1 2024', '2024-01-01')",
+    "end_date": "end date (e.g., 'today', 'December 31 2024', '2024-12-31')",
+    "cluster_id": "cluster code (e.g., 'RJC01', 'MHC05')",
+    "cso_id": "CSO ID code (e.g., 'CSO001')",
+    "state_id": "state code (e.g., 'BH', 'RJ', 'MH')",
+    "business_category": "business unit (e.g., 'FMEG', 'Wires & Cables', 'Wiring Devices & Switchgear')"
+}
+
+# Natural phrasing when exactly one parameter is missing
+SINGLE_PARAM_PROMPTS: Dict[str, str] = {
+    "start_date": "For which time period? You can say something like 'last month', 'this quarter', or give me specific dates.",
+    "end_date": "Until when? You can say 'today', 'end of last month', or a specific date.",
+    "n": "How many results would you like to see? For example, 'top 5' or just '10'.",
+    "state_id": "Which state are you interested in? Please provide the state code (e.g., 'RJ', 'MH', 'BH').",
+    "cluster_id": "Which cluster? Please provide the cluster code (e.g., 'RJC01', 'MHC05').",
+    "cso_id": "Which CSO are you looking for? Please provide the CSO ID.",
+    "business_category": "Which business unit? You can say 'FMEG', 'Wires & Cables', 'Switchgear' or their export variant."
+}
+
+
 def get_parameter_guidance() -> Dict[str, str]:
-    """Returns user-friendly examples for each parameter type."""
-    return {
-        "n": "a number (e.g., 'top 5', 'best 10', or just '5')",
-        "sort": "sorting direction (e.g., 'highest', 'lowest', 'top', 'bottom')",
-        "start_date": "start date (e.g., 'last month', 'January 1 2024', '2024-01-01')",
-        "end_date": "end date (e.g., 'today', 'December 31 2024', '2024-12-31')",
-        "cluster_id": "cluster code (e.g., 'RJC01', 'MHC05')",
-        "cso_id": "CSO ID code (e.g., 'CSO001')",
-        "state_id": "state code (e.g., 'BH', 'RJ', 'MH')",
-        "business_category": "business unit (e.g., 'FMEG', 'Wires & Cables', 'Wiring Devices & Switchgear')"
-    }
- 
- 
-def calculate_date_from_placeholder(placeholder: str) -> str:
-    """
-    Converts date placeholder tokens to actual YYYY-MM-DD dates.
-   
-    Placeholders:
-    - __LAST_MONTH_START__: First day of last month
-    - __LAST_MONTH_END__: Last day of last month
-    - __THIS_MONTH_START__: First day of current month
-    - __THIS_MONTH_END__: Last day of current month
-    - __LAST_QUARTER_START__: First day of last quarter
-    - __LAST_QUARTER_END__: Last day of last quarter
-    """
-    today = datetime.now()
-   
-    if placeholder == "__LAST_MONTH_START__":
-        first_of_last_month = (today.replace(day=1) - timedelta(days=1)).replace(day=1)
-        return first_of_last_month.strftime("%Y-%m-%d")
-   
-    elif placeholder == "__LAST_MONTH_END__":
-        first_of_this_month = today.replace(day=1)
-        last_of_last_month = first_of_this_month - timedelta(days=1)
-        return last_of_last_month.strftime("%Y-%m-%d")
-   
-    elif placeholder == "__THIS_MONTH_START__":
-        return today.replace(day=1).strftime("%Y-%m-%d")
-   
-    elif placeholder == "__THIS_MONTH_END__":
-        next_month = today.replace(day=28) + timedelta(days=4)
-        last_of_this_month = next_month - timedelta(days=next_month.day)
-        return last_of_this_month.strftime("%Y-%m-%d")
-   
-    elif placeholder == "__LAST_QUARTER_START__":
-        current_quarter = (today.month - 1) // 3
-        if current_quarter == 0:
-            # Last quarter is Q4 of previous year
-            last_q_start = datetime(today.year - 1, 10, 1)
-        else:
-            last_q_start = datetime(today.year, (current_quarter - 1) * 3 + 1, 1)
-        return last_q_start.strftime("%Y-%m-%d")
-   
-    elif placeholder == "__LAST_QUARTER_END__":
-        current_quarter = (today.month - 1) // 3
-        if current_quarter == 0:
-            # Last quarter is Q4 of previous year
-            last_q_end = datetime(today.year - 1, 12, 31)
-        else:
-            last_q_end_month = current_quarter * 3
-            last_q_end = (datetime(today.year, last_q_end_month, 28) + timedelta(days=4))
-            last_q_end = last_q_end - timedelta(days=last_q_end.day)
-        return last_q_end.strftime("%Y-%m-%d")
-   
-    # If not a placeholder, return as-is
-    return placeholder
+    """Returns user-friendly examples for each parameter type (shared dict, do not mutate)."""
+    return PARAMETER_GUIDANCE
  
  
 # def format_missing_params_message(missing: List[str], attempt: int, max_attempts: int) -> str:
@@ -772,25 +1252,18 @@ def calculate_date_from_placeholder(placeholder: str) -> str:
 
 def format_missing_params_message(missing: List[str], attempt: int, max_attempts: int) -> str:
     """Creates user-friendly conversational message for missing parameters."""
-    guidance = get_parameter_guidance()
+    guidance = PARAMETER_GUIDANCE
     
     # Build conversational prompt based on what's missing
     if len(missing) == 1:
         param = missing[0]
-        example = guidance.get(param, 'please specify')
         
         # Single parameter - very natural phrasing
-        prompts = {
-            "start_date": f"For which time period? You can say something like 'last month', 'this quarter', or give me specific dates.",
-            "end_date": f"Until when? You can say 'today', 'end of last month', or a specific date.",
-            "n": f"How many results would you like to see? For example, 'top 5' or just '10'.",
-            "state_id": f"Which state are you interested in? Please provide the state code (e.g., 'RJ', 'MH', 'BH').",
-            "cluster_id": f"Which cluster? Please provide the cluster code (e.g., 'RJC01', 'MHC05').",
-            "cso_id": f"Which CSO are you looking for? Please provide the CSO ID.",
-            "business_category": f"Which business unit? You can say 'FMEG', 'Wires & Cables', 'Switchgear' or their export variant."
-        }
-        
-        return prompts.get(param, f"Could you specify the {param.replace('_', ' ')}? ({example})")
+        prompt = SINGLE_PARAM_PROMPTS.get(param)
+        if prompt:
+            return prompt
+        example = guidance.get(param, 'please specify')
+        return f"Could you specify the {param.replace('_', ' ')}? ({example})"
     
     elif len(missing) == 2:
         # Two parameters - natural conjunction
@@ -819,49 +1292,93 @@ def format_missing_params_message(missing: List[str], attempt: int, max_attempts
             return f"I need some more information: {items}, and {param_list[-1]}."
  
  
-def extract_from_original_question(original_question: str, param: str) -> Any:
+# --- Pre-compiled patterns for extract_from_original_question (matched against the uppercased question) ---
+N_PATTERNS = (
+    # Pattern 1: "top 5", "bottom 3", "best 10" (with optional words after)
+    re.compile(r'\b(?:TOP|BOTTOM|BEST|WORST|FIRST|LAST|MINIMUM|MAXIMUM)\s+(\d+)'),
+    # Pattern 2: "5 top performers", "10 salespersons"
+    re.compile(r'\b(\d+)\s+(?:TOP|BOTTOM|BEST|WORST|SALESPERSON|SALES|EXECUTIVE|PERFORMER|PERFORMING)'),
+)
+# Use word boundaries to avoid matching "MIN" in "PERFORMING"
+SORT_ASC_PATTERN = re.compile(r'\b(BOTTOM|WORST|LOWEST|LEAST|MINIMUM|POOREST|WEAKEST)\b')
+SORT_DESC_PATTERN = re.compile(r'\b(TOP|BEST|HIGHEST|MOST|MAXIMUM|GREATEST|STRONGEST|LARGEST)\b')
+# Codes with numbers (RJC01, MHC05, CSO001) and bare 2-letter codes
+CODE_WITH_NUMBER_PATTERN = re.compile(r'\b[A-Z]{2,4}\d+\b')
+TWO_LETTER_CODE_PATTERN = re.compile(r'\b([A-Z]{2})\b')
+# Common English words that look like 2-letter codes
+TWO_LETTER_EXCLUDE_WORDS = frozenset({'IN', 'ON', 'BY', 'TO', 'AT', 'OR', 'SO', 'AS', 'IS', 'OF', 'AN', 'IF', 'IT'})
+
+# Relative period phrases (matched against the lowercased question); group names
+# are DateContext field prefixes
+DATE_PHRASE_PATTERN = re.compile(
+    r'(?P<last_quarter>last quarter|previous quarter)'
+    r'|(?P<last_month>last month|previous month)'
+    r'|(?P<this_month>this month|current month)'
+    r'|(?P<this_year>this year|current year)'
+    r'|(?P<last_year>last year|previous year)'
+)
+DATE_PERIOD_PRIORITY = ("last_quarter", "last_month", "this_month", "this_year", "last_year")
+
+# Business category keywords → SQL-quoted category (substring match on the uppercased question)
+BUSINESS_CATEGORY_KEYWORDS = {
+    "FMEG": "'FMEG'", "FAST MOVING": "'FMEG'",
+    "W&C": "'Wires & Cables'", "WIRES": "'Wires & Cables'", "CABLES": "'Wires & Cables'",
+    "WIRE AND CABLE": "'Wires & Cables'",
+    "WIRING DEVICES": "'Wiring Devices & Switchgear'", "SWITCHGEAR": "'Wiring Devices & Switchgear'",
+    "SWITCHES": "'Wiring Devices & Switchgear'", "SWITCH": "'Wiring Devices & Switchgear'",
+}
+# Output order of extracted categories, independent of where they appear in the question
+BUSINESS_CATEGORIES = ("'FMEG'", "'Wires & Cables'", "'Wiring Devices & Switchgear'")
+# All keywords in one alternation, so the question is scanned once. Wrapped in a
+# lookahead so overlapping hits ("WIRESWITCH") are all reported, like plain `in` checks
+BUSINESS_CATEGORY_PATTERN = re.compile(
+    '(?=(' + '|'.join(map(re.escape, sorted(BUSINESS_CATEGORY_KEYWORDS, key=len, reverse=True))) + '))'
+)
+
+# State name → code mapping (for state_id extraction)
+STATE_NAME_MAP = {
+    'rajasthan': 'RJ', 'gujarat': 'GJ', 'maharashtra': 'MH',
+    'delhi': 'DL', 'karnataka': 'KA', 'tamil nadu': 'TN',
+    'kerala': 'KL', 'andhra pradesh': 'AP', 'telangana': 'TS',
+    'uttar pradesh': 'UP', 'madhya pradesh': 'MP', 'punjab': 'PB',
+    'haryana': 'HR', 'west bengal': 'WB', 'bihar': 'BR',
+    'odisha': 'OR', 'jharkhand': 'JH', 'chhattisgarh': 'CG',
+    'assam': 'AS', 'goa': 'GA', 'himachal': 'HP',
+    'uttarakhand': 'UK', 'jammu': 'JK', 'gujrat': 'GJ',  # Common misspelling
+}
+# One scan for every state name; whole words only, so "goal" no longer reads as Goa
+STATE_NAME_PATTERN = re.compile(r'\b(' + '|'.join(map(re.escape, STATE_NAME_MAP)) + r')\b', re.IGNORECASE)
+
+
+def extract_from_original_question(original_question: str, param: str, *, upper_q: str = None, lower_q: str = None) -> Any:
     """
     Tries to extract parameter directly from the original question.
     This is a fallback when LLM extraction fails.
+    Callers looping over params can pass the pre-cased question as upper_q / lower_q.
     """
-    upper_q = original_question.upper()
+    if upper_q is None:
+        upper_q = original_question.upper()
    
     # Extract 'n' from phrases like "top 3", "bottom 5", "best 10", "top 5 performers"
     if param == "n":
-        import re
-        patterns = [
-            # Pattern 1: "top 5", "bottom 3", "best 10" (with optional words after)
-            r'\b(?:TOP|BOTTOM|BEST|WORST|FIRST|LAST|MINIMUM|MAXIMUM)\s+(\d+)',
-            # Pattern 2: "5 top performers", "10 salespersons"
-            r'\b(\d+)\s+(?:TOP|BOTTOM|BEST|WORST|SALESPERSON|SALES|EXECUTIVE|PERFORMER|PERFORMING)'
-        ]
-        for pattern in patterns:
-            match = re.search(pattern, upper_q)
+        for pattern in N_PATTERNS:
+            match = pattern.search(upper_q)
             if match:
                 return int(match.group(1))
    
     # Extract 'sort' from top/bottom keywords (separate from 'n' extraction)
     if param == "sort":
-        import re
         # Bottom/Worst keywords → ASC (lowest first)
-        # Use word boundaries to avoid matching "MIN" in "PERFORMING"
-        asc_pattern = r'\b(BOTTOM|WORST|LOWEST|LEAST|MINIMUM|POOREST|WEAKEST)\b'
-        if re.search(asc_pattern, upper_q):
+        if SORT_ASC_PATTERN.search(upper_q):
             return "ASC"
         # Top/Best keywords → DESC (highest first)
-        desc_pattern = r'\b(TOP|BEST|HIGHEST|MOST|MAXIMUM|GREATEST|STRONGEST|LARGEST)\b'
-        if re.search(desc_pattern, upper_q):
+        if SORT_DESC_PATTERN.search(upper_q):
             return "DESC"
    
     # Extract business_category (can be multiple - format for SQL IN clause)
     if param == "business_category":
-        categories = []
-        if "FMEG" in upper_q or "FAST MOVING" in upper_q:
-            categories.append("'FMEG'")
-        if any(word in upper_q for word in ["W&C", "WIRES", "CABLES", "WIRE AND CABLE"]):
-            categories.append("'Wires & Cables'")
-        if any(word in upper_q for word in ["WIRING DEVICES", "SWITCHGEAR", "SWITCHES", "SWITCH"]):
-            categories.append("'Wiring Devices & Switchgear'")
+        found = {BUSINESS_CATEGORY_KEYWORDS[match.group(1)] for match in BUSINESS_CATEGORY_PATTERN.finditer(upper_q)}
+        categories = [category for category in BUSINESS_CATEGORIES if category in found]
         # Note: "Export" here is a category filter, not the export sales type
         # Don't extract Export as business_category from question - it's handled by query routing
         if categories:
@@ -869,112 +1386,151 @@ def extract_from_original_question(original_question: str, param: str) -> Any:
    
     # Extract cluster_id, cso_id, state_id (alphanumeric codes)
     if param in ["cluster_id", "cso_id", "state_id"]:
-        import re
         
         # STATE NAME TO CODE MAPPING (for state_id extraction)
         if param == "state_id":
-            state_name_map = {
-                'rajasthan': 'RJ', 'gujarat': 'GJ', 'maharashtra': 'MH',
-                'delhi': 'DL', 'karnataka': 'KA', 'tamil nadu': 'TN',
-                'kerala': 'KL', 'andhra pradesh': 'AP', 'telangana': 'TS',
-                'uttar pradesh': 'UP', 'madhya pradesh': 'MP', 'punjab': 'PB',
-                'haryana': 'HR', 'west bengal': 'WB', 'bihar': 'BR',
-                'odisha': 'OR', 'jharkhand': 'JH', 'chhattisgarh': 'CG',
-                'assam': 'AS', 'goa': 'GA', 'himachal': 'HP',
-                'uttarakhand': 'UK', 'jammu': 'JK', 'gujrat': 'GJ',  # Common misspelling
-            }
-            lower_q = original_question.lower()
-            for state_name, state_code in state_name_map.items():
-                if state_name in lower_q:
-                    return state_code
+            match = STATE_NAME_PATTERN.search(original_question)
+            if match:
+                return STATE_NAME_MAP[match.group(1).lower()]
         
         # PRIORITY 1: Look for codes with numbers (more specific): RJC01, MHC05, CSO001
-        codes_with_numbers = re.findall(r'\b[A-Z]{2,4}\d+\b', upper_q)
+        codes_with_numbers = CODE_WITH_NUMBER_PATTERN.findall(upper_q)
         if codes_with_numbers:
             return codes_with_numbers[0]
        
         # PRIORITY 2: Look for 2-letter state codes NOT followed by common words
         # Exclude common words like: IN, ON, BY, TO, AT, OR, SO, AS, IS
-        exclude_words = {'IN', 'ON', 'BY', 'TO', 'AT', 'OR', 'SO', 'AS', 'IS', 'OF', 'AN', 'IF', 'IT'}
-        codes_two_letter = re.findall(r'\b([A-Z]{2})\b', upper_q)
-        for code in codes_two_letter:
-            if code not in exclude_words:
-                return code
+        # finditer + next() stops at the first real code instead of collecting every match
+        code = next(
+            (m.group(1) for m in TWO_LETTER_CODE_PATTERN.finditer(upper_q) if m.group(1) not in TWO_LETTER_EXCLUDE_WORDS),
+            None
+        )
+        if code:
+            return code
 
     # Extract start_date / end_date from relative time expressions
     if param in ["start_date", "end_date"]:
-        lower_q = original_question.lower()
-        today = datetime.now()
-        
-        # Last quarter
-        if "last quarter" in lower_q or "previous quarter" in lower_q:
-            current_quarter = (today.month - 1) // 3
-            if current_quarter == 0:
-                # Last quarter is Q4 of previous year
-                if param == "start_date":
-                    return datetime(today.year - 1, 10, 1).strftime("%Y-%m-%d")
-                else:  # end_date
-                    return datetime(today.year - 1, 12, 31).strftime("%Y-%m-%d")
-            else:
-                last_q_start_month = (current_quarter - 1) * 3 + 1
-                last_q_end_month = current_quarter * 3
-                if param == "start_date":
-                    return datetime(today.year, last_q_start_month, 1).strftime("%Y-%m-%d")
-                else:  # end_date
-                    last_q_end = datetime(today.year, last_q_end_month, 28) + timedelta(days=4)
-                    last_q_end = last_q_end - timedelta(days=last_q_end.day)
-                    return last_q_end.strftime("%Y-%m-%d")
-        
-        # Last month
-        if "last month" in lower_q or "previous month" in lower_q:
-            first_of_this_month = today.replace(day=1)
-            last_of_last_month = first_of_this_month - timedelta(days=1)
-            first_of_last_month = last_of_last_month.replace(day=1)
-            if param == "start_date":
-                return first_of_last_month.strftime("%Y-%m-%d")
-            else:  # end_date
-                return last_of_last_month.strftime("%Y-%m-%d")
-        
-        # This month
-        if "this month" in lower_q or "current month" in lower_q:
-            if param == "start_date":
-                return today.replace(day=1).strftime("%Y-%m-%d")
-            else:  # end_date
-                next_month = today.replace(day=28) + timedelta(days=4)
-                last_of_month = next_month - timedelta(days=next_month.day)
-                return last_of_month.strftime("%Y-%m-%d")
-        
-        # This year
-        if "this year" in lower_q or "current year" in lower_q:
-            if param == "start_date":
-                return datetime(today.year, 1, 1).strftime("%Y-%m-%d")
-            else:  # end_date
-                return datetime(today.year, 12, 31).strftime("%Y-%m-%d")
-        
-        # Last year
-        if "last year" in lower_q or "previous year" in lower_q:
-            if param == "start_date":
-                return datetime(today.year - 1, 1, 1).strftime("%Y-%m-%d")
-            else:  # end_date
-                return datetime(today.year - 1, 12, 31).strftime("%Y-%m-%d")
+        if lower_q is None:
+            lower_q = original_question.lower()
+        # One scan finds every period phrase; the earliest period in DATE_PERIOD_PRIORITY wins
+        found = {match.lastgroup for match in DATE_PHRASE_PATTERN.finditer(lower_q)}
+        if found:
+            dates = get_date_context(date.today())
+            suffix = "_start" if param == "start_date" else "_end"
+            for period in DATE_PERIOD_PRIORITY:
+                if period in found:
+                    return getattr(dates, period + suffix)
 
     return None
- 
- 
+
+
+
+LOCATION_CODE_PARAMS = frozenset({"cluster_id", "cso_id", "state_id"})
+_UNSCANNED = object()  # sentinel: scan not run yet (None is a valid "nothing found")
+
+
+def extract_all_params(original_question: str, params: List[str], *, lower_q: str = None) -> Dict[str, Any]:
+    """
+    Batch form of extract_from_original_question: same per-param results, but
+    each pattern family is scanned at most once per question (the location
+    codes are shared by state/cso/cluster, the date phrases by start/end).
+    Returns only the params that were found, in the order given.
+    """
+    upper_q = original_question.upper()
+    location_code = date_periods = _UNSCANNED
+    extracted = {}
+
+    for param in params:
+        if param in LOCATION_CODE_PARAMS:
+            if param == "state_id":
+                match = STATE_NAME_PATTERN.search(original_question)
+                if match:
+                    extracted[param] = STATE_NAME_MAP[match.group(1).lower()]
+                    continue
+            if location_code is _UNSCANNED:
+                location_code = extract_from_original_question(original_question, "cso_id", upper_q=upper_q)
+            val = location_code
+        elif param in PERIOD_PARAMS:
+            if date_periods is _UNSCANNED:
+                if lower_q is None:
+                    lower_q = original_question.lower()
+                date_periods = {match.lastgroup for match in DATE_PHRASE_PATTERN.finditer(lower_q)}
+            val = None
+            if date_periods:
+                dates = get_date_context(date.today())
+                suffix = "_start" if param == "start_date" else "_end"
+                period = next(period for period in DATE_PERIOD_PRIORITY if period in date_periods)
+                val = getattr(dates, period + suffix)
+        else:
+            val = extract_from_original_question(original_question, param, upper_q=upper_q)
+        if val is not None:
+            extracted[param] = val
+
+    return extracted
+
+
+ALL_BUSINESS_CATEGORIES = "'FMEG', 'Wiring Devices & Switchgear', 'Wires & Cables'"
+ALL_CATEGORY_ANSWERS = frozenset({"all", "all categories", "everything", "all of them"})
+
+# Params the rule-based extractors can fill on their own; if these are all that
+# is missing, the parameter-extraction LLM call is skipped
+DETERMINISTIC_PARAMS = frozenset({"n", "sort", "start_date", "end_date", "business_category"})
+
+
+def extract_deterministic_params(question: str, missing_params: List[str], *, lower_q: str = None) -> Dict[str, Any]:
+    """
+    Rule-based pass over a clarification answer for the DETERMINISTIC_PARAMS
+    still missing ("top 5", "lowest", "last quarter", "FMEG", "all").
+    """
+    if lower_q is None:
+        lower_q = question.lower()
+    wanted = [p for p in missing_params if p in DETERMINISTIC_PARAMS]
+    extracted = extract_all_params(question, wanted, lower_q=lower_q) if wanted else {}
+    if "business_category" in wanted and lower_q.strip() in ALL_CATEGORY_ANSWERS:
+        extracted["business_category"] = ALL_BUSINESS_CATEGORIES
+    return extracted
+
+
+def looks_like_fresh_query(question: str) -> bool:
+    """
+    True for messages that state a complete new query on their own: an explicit
+    "top/bottom N", a relative period, and a category or state name
+    (e.g. "top 5 FMEG sales last month").
+    """
+    upper_q = question.upper()
+    return bool(
+        N_PATTERNS[0].search(upper_q)
+        and DATE_PHRASE_PATTERN.search(question.lower())
+        and (BUSINESS_CATEGORY_PATTERN.search(upper_q) or STATE_NAME_PATTERN.search(question))
+    )
+
+
 # --- 5. Core Agent Function ---
 
 def lookup_cso_by_name(connection_string: str, name: str) -> List[Tuple[str, str, str]]:
     """
     Looks up CSO IDs by name.
     Returns: List of (csoid, csoname, businesscategory)
+    Served from CSO_LOOKUP_CACHE for CSO_LOOKUP_TTL_SECONDS so CSO table edits show up
+    without a restart; the name is bound by the driver, never interpolated.
     """
-    sql = f"SELECT csoid, name, businesscategory FROM pwccso_pocdetails WHERE LOWER(name) LIKE LOWER('%{name}%')"
-    try:
-        columns, rows = execute_sql_query_from_string(connection_string, sql)
-        return [(row[0], row[1], row[2]) for row in rows]
-    except Exception as e:
-        print(f"[ERROR] CSO lookup failed: {e}")
-        return []
+    key = (connection_string, name.lower())
+    matches = CSO_LOOKUP_CACHE.get(key)
+    if matches is None:
+        try:
+            columns, rows = execute_sql_query_from_string(connection_string, CSO_LOOKUP_SQL, (f"%{key[1]}%",))
+        except Exception as e:
+            # Failures are not cached
+            print(f"[ERROR] CSO lookup failed: {e}")
+            return []
+        matches = tuple((row[0], row[1], row[2]) for row in rows)
+        CSO_LOOKUP_CACHE.put(key, matches)
+    return list(matches)
+
+
+CSO_LOOKUP_SQL = "SELECT csoid, name, businesscategory FROM pwccso_pocdetails WHERE LOWER(name) LIKE ?"
+CSO_LOOKUP_TTL_SECONDS = 600
+CSO_LOOKUP_CACHE = LRUCache(maxsize=512, ttl=CSO_LOOKUP_TTL_SECONDS)
 
 
 # def lookup_cluster_by_name(connection_string: str, name: str) -> List[Tuple[str, str]]:
@@ -1061,10 +1617,13 @@ def merge_params_safely(existing: dict, incoming: dict):
     """
     Allows LLM extraction to correct pre-extracted values
     without losing already-confirmed values.
+    Keys are interned: they come from json.loads, and collected_params is
+    probed by the (already interned) literal param names on every turn.
     """
     for k, v in incoming.items():
         if v in [None, "", "SKIP"]:
             continue
+        k = sys.intern(k)
 
         if k not in existing or existing[k] in [None, "", "SKIP"]:
             existing[k] = v
@@ -1074,12 +1633,126 @@ def merge_params_safely(existing: dict, incoming: dict):
                 existing[k] = v
 
 
+def respond_to_acknowledgment(chat_state: ChatState, user_question: str) -> str:
+    """ACKNOWLEDGMENT - user is just reacting, no query needed."""
+    # Check for goodbye phrases
+    if GOODBYE_PATTERN.search(user_question.lower()):
+        goodbye_response = "Goodbye! Feel free to return anytime you need help with sales data. Have a great day! 👋"
+        chat_state.add_turn("assistant", goodbye_response)
+        return json.dumps({"bot_answer": goodbye_response})
+    
+    ack_response = "ya! so is there anything else you'd like to know about the sales data?"
+    chat_state.add_turn("assistant", ack_response)
+    return json.dumps({"bot_answer": ack_response})
+
+
+def respond_to_clarification_question(chat_state: ChatState, user_question: str) -> str:
+    """CLARIFICATION_QUESTION - user is asking ABOUT the previous result."""
+    if chat_state.last_rows and chat_state.last_columns and chat_state.last_query_context:
+        # Get the sort direction that was used
+        direction_word = "lowest/bottom" if chat_state.last_sort_direction == "ASC" else "highest/top"
+        
+        # Get the first result from previous query
+        first_result = chat_state.last_rows[0] if chat_state.last_rows else []
+        result_name = first_result[0] if first_result else "unknown"
+        result_value = first_result[1] if len(first_result) > 1 else "N/A"
+        
+        clarification = f"That was the **{direction_word}** performer. {result_name} with ₹{result_value:,.0f} was the {direction_word.split('/')[0]} for the period."
+        chat_state.add_turn("assistant", clarification)
+        return json.dumps({"bot_answer": clarification})
+    else:
+        return json.dumps({"bot_answer": "I don't have a previous result to clarify. Could you ask your question again?"})
+
+
+# Context query types that get a direct reply instead of a SQL query
+# (FOLLOW_UP / NEW_QUERY fall through to parameter inheritance)
+QUERY_TYPE_RESPONDERS = {
+    "ACKNOWLEDGMENT": respond_to_acknowledgment,
+    "CLARIFICATION_QUESTION": respond_to_clarification_question,
+}
+
+
+# Final answers grouped by result key (final SQL, filter context, date); each group holds
+# the questions already answered from that result. The TTL bounds staleness as the
+# sales tables keep changing; the date in the key covers relative periods rolling over.
+RESPONSE_CACHE_TTL_SECONDS = 600
+RESPONSE_CACHE = LRUCache(maxsize=256, ttl=RESPONSE_CACHE_TTL_SECONDS)
+RESPONSE_CACHE_GROUP_SIZE = 8
+PUNCTUATION_PATTERN = re.compile(r'[^\w\s]')
+
+
+class CachedResponse:
+    """One answered question within a RESPONSE_CACHE group."""
+    __slots__ = ("question", "answer", "columns", "rows")
+    
+    def __init__(self, question: str, answer: str, columns: List[str], rows: List[List]):
+        self.question = question
+        self.answer = answer
+        self.columns = columns
+        self.rows = rows
+
+
+def canonicalize_question(question: str) -> str:
+    """normalize_question plus punctuation removal, for the response cache key."""
+    return normalize_question(PUNCTUATION_PATTERN.sub(' ', question))
+
+
+def lookup_cached_response(result_key: Tuple, question: str) -> Tuple[Optional[CachedResponse], bool]:
+    """
+    Returns (entry, answer_reusable) for this SQL result.
+    The answer is only reused for the same canonical question. A reworded question
+    ("which CSO sold most" vs "list sales by CSO") gets the cached rows, skipping the
+    database, but still needs an answer phrased for it.
+    """
+    group = RESPONSE_CACHE.get(result_key)
+    if not group:
+        return None, False
+    
+    canonical = canonicalize_question(question)
+    for entry in group:
+        if entry.question == canonical:
+            return entry, True
+    return group[-1], False
+
+
+def store_cached_response(result_key: Tuple, question: str, answer: str, columns: List[str], rows: List[List]):
+    """
+    Adds a freshly generated answer to its group. Older answers built from
+    different rows are dropped, so the group's TTL restarts only for answers
+    that match the current data.
+    """
+    group = [
+        entry for entry in (RESPONSE_CACHE.get(result_key) or ())
+        if entry.rows == rows and entry.columns == columns
+    ]
+    group.append(CachedResponse(canonicalize_question(question), answer, columns, rows))
+    RESPONSE_CACHE.put(result_key, group[-RESPONSE_CACHE_GROUP_SIZE:])
+
+
+def switch_pending_query(chat_state: ChatState, query_id: str, label: str) -> Optional[List[str]]:
+    """
+    Points the pending query at query_id's template (SQL, optional params, defaults).
+    Returns the new query's required params, or None if the ID is unknown, in
+    which case chat_state is left unchanged.
+    """
+    try:
+        _, sql_template, req, opt, defaults = get_query_by_id(query_id)
+    except ValueError as e:
+        print(f"[DEBUG] {label} switch failed: {e}")
+        return None
+    chat_state.pending_query_id = query_id
+    chat_state.last_query_template = sql_template
+    chat_state.optional_params = opt
+    chat_state.param_defaults = defaults
+    return req
+
+
 def run_sql_rag_agent(user_question: str, connection_string: str, chat_state: ChatState) -> str:
     try:
-        clean_q = user_question.lower().strip()
-        reset_keywords = ["start over", "reset", "begin again", "clear", "new question", "skip"]
+        question_lower = user_question.lower()  # Reused below instead of re-lowercasing
+        clean_q = question_lower.strip()
         
-        if any(word in clean_q for word in reset_keywords):
+        if RESET_PATTERN.search(clean_q):
             chat_state.clear_all()
             return json.dumps({"bot_answer": "No problem! I've cleared everything. What new sales data can I help you find?"}) 
         
@@ -1087,12 +1760,13 @@ def run_sql_rag_agent(user_question: str, connection_string: str, chat_state: Ch
         # 1️⃣ ADD USER MESSAGE TO HISTORY
         # ========================================
         chat_state.add_turn("user", user_question)
+        normalized_question = normalize_question(user_question)
         
         # ========================================
         # 2️⃣ INTENT ROUTING
         # ========================================
         if not chat_state.pending_query_id:
-            intent = INTENT_CHAIN.invoke({"question": user_question}).strip().upper()
+            intent = classify_intent(user_question, normalized_question)
             print(f"[DEBUG] Intent: {intent}")
                
             if intent in ["REJECT"]:
@@ -1109,16 +1783,11 @@ def run_sql_rag_agent(user_question: str, connection_string: str, chat_state: Ch
                 return json.dumps({"bot_answer": "All clear. What would you like to ask now?"})
             
             # TABLE MODE - Show raw values for data accuracy
-            if user_question.strip().lower() in ["table", "in table", "show table", "display table", "show in table", "as table", "in table format", "table format"]:
+            if normalized_question in TABLE_PHRASES:
                 if chat_state.last_rows and chat_state.last_columns:
-                    table_prompt = ChatPromptTemplate.from_messages([
-                        ("system", "Format the following data as a markdown table. Output ONLY the table. Keep numeric values exactly as provided."),
-                        ("human", "Columns: {columns}\nRows: {rows}")
-                    ])
-                    table_chain = table_prompt | LLM | StrOutputParser()
-                    table = table_chain.invoke({
+                    table = get_table_chain().invoke({
                         "columns": str(chat_state.last_columns),
-                        "rows": str(chat_state.last_rows)
+                        "rows": format_rows_for_prompt(chat_state.last_rows)
                     })
                     return json.dumps({"bot_answer": table})
                 else:
@@ -1130,73 +1799,26 @@ def run_sql_rag_agent(user_question: str, connection_string: str, chat_state: Ch
         inherited_params = {}
         override_hints = {}
         is_follow_up = False  # Track if this is a follow-up query
+        query_family = None  # Router label from context analysis, saves the router call
         
         if chat_state.has_context() and not chat_state.pending_query_id:
             try:
-                context_input = {
-                    "conversation_history": chat_state.get_history_for_llm(),
-                    "last_question": chat_state.last_query_context,
-                    "last_query_id": chat_state.last_query_id,
-                    "last_params": json.dumps(chat_state.last_successful_params),
-                    "current_message": user_question,
-                    "current_date": datetime.now().strftime("%Y-%m-%d")  # Pass current date for date calculations
-                }
-                
-                context_result = CONTEXT_CHAIN.invoke(context_input)
-                
-                # Robust JSON extraction - handle nested braces properly
-                def extract_json(text):
-                    """Extract first valid JSON object, handling nested braces."""
-                    start = text.find('{')
-                    if start == -1:
-                        return None
-                    
-                    depth = 0
-                    for i, char in enumerate(text[start:], start):
-                        if char == '{':
-                            depth += 1
-                        elif char == '}':
-                            depth -= 1
-                            if depth == 0:
-                                return text[start:i+1]
-                    return None
-                
-                json_str = extract_json(context_result)
-                if json_str:
-                    # Clean up common JSON formatting issues from LLM
-                    import re
-                    # Remove trailing commas before } or ]
-                    json_str = re.sub(r',\s*([}\]])', r'\1', json_str)
-                    # Add missing commas between "value" "key" patterns
-                    json_str = re.sub(r'"\s+(")', r'", \1', json_str)
-                    # Fix unquoted values that should be strings
-                    json_str = re.sub(r':\s*([A-Z_]+)(\s*[,}])', r': "\1"\2', json_str)
-                    
-                    try:
-                        context_data = json.loads(json_str)
-                    except json.JSONDecodeError:
-                        # If still fails, try to extract key fields manually
-                        context_data = {}
-                        if '"FOLLOW_UP"' in json_str or "'FOLLOW_UP'" in json_str:
-                            context_data['query_type'] = 'FOLLOW_UP'
-                            context_data['confidence'] = 'HIGH'
-                            # Inherit all previous params to maintain context
-                            context_data['inherit_params'] = list(chat_state.last_successful_params.keys())
-                        print(f"[DEBUG] JSON cleanup failed, using fallback: {context_data}")
+                if looks_like_fresh_query(user_question):
+                    # Self-contained question: skip the context LLM, nothing to inherit
+                    context_data = {"query_type": "NEW_QUERY", "confidence": "HIGH"}
+                    print(f"[DEBUG] Fresh query detected, skipping context analysis")
                 else:
-                    # extract_json returned None - try parsing raw or fallback
-                    try:
-                        context_data = json.loads(context_result)
-                    except json.JSONDecodeError:
-                        # Check if it looks like a follow-up and inherit all params
-                        context_data = {}
-                        if 'FOLLOW_UP' in context_result.upper():
-                            context_data['query_type'] = 'FOLLOW_UP'
-                            context_data['confidence'] = 'HIGH'
-                            context_data['inherit_params'] = list(chat_state.last_successful_params.keys())
-                            print(f"[DEBUG] Fallback FOLLOW_UP from raw response, inheriting: {context_data['inherit_params']}")
-                        else:
-                            print(f"[DEBUG] Could not parse context, treating as NEW_QUERY")
+                    # Runs only after the intent verdict, so reject / greeting / reset turns never pay for it
+                    context_input = {
+                        "conversation_history": chat_state.get_history_for_llm(),
+                        "last_question": chat_state.last_query_context,
+                        "last_query_id": chat_state.last_query_id,
+                        "last_params": chat_state.get_last_params_json(),
+                        "current_message": user_question,
+                        "current_date": datetime.now().strftime("%Y-%m-%d")  # Pass current date for date calculations
+                    }
+                    
+                    context_data = analyze_context(context_input, list(chat_state.last_successful_params.keys()))
                 
                 print(f"[DEBUG] Context Analysis: {context_data}")
                 
@@ -1204,35 +1826,10 @@ def run_sql_rag_agent(user_question: str, connection_string: str, chat_state: Ch
                 confidence = context_data.get("confidence")
                 
                 if confidence in ["HIGH", "MEDIUM"]:
-                    # Handle ACKNOWLEDGMENT - user is just reacting, no query needed
-                    if query_type == "ACKNOWLEDGMENT":
-                        # Check for goodbye phrases
-                        goodbye_phrases = ["bye", "goodbye", "see you", "thanks bye", "thank you bye", "cya", "later", "take care"]
-                        if any(phrase in user_question.lower() for phrase in goodbye_phrases):
-                            goodbye_response = "Goodbye! Feel free to return anytime you need help with sales data. Have a great day! 👋"
-                            chat_state.add_turn("assistant", goodbye_response)
-                            return json.dumps({"bot_answer": goodbye_response})
-                        
-                        ack_response = "ya! so is there anything else you'd like to know about the sales data?"
-                        chat_state.add_turn("assistant", ack_response)
-                        return json.dumps({"bot_answer": ack_response})
-                    
-                    # Handle CLARIFICATION_QUESTION - user is asking ABOUT the previous result
-                    if query_type == "CLARIFICATION_QUESTION":
-                        if chat_state.last_rows and chat_state.last_columns and chat_state.last_query_context:
-                            # Get the sort direction that was used
-                            direction_word = "lowest/bottom" if chat_state.last_sort_direction == "ASC" else "highest/top"
-                            
-                            # Get the first result from previous query
-                            first_result = chat_state.last_rows[0] if chat_state.last_rows else []
-                            result_name = first_result[0] if first_result else "unknown"
-                            result_value = first_result[1] if len(first_result) > 1 else "N/A"
-                            
-                            clarification = f"That was the **{direction_word}** performer. {result_name} with ₹{result_value:,.0f} was the {direction_word.split('/')[0]} for the period."
-                            chat_state.add_turn("assistant", clarification)
-                            return json.dumps({"bot_answer": clarification})
-                        else:
-                            return json.dumps({"bot_answer": "I don't have a previous result to clarify. Could you ask your question again?"})
+                    # ACKNOWLEDGMENT / CLARIFICATION_QUESTION are answered directly, no query needed
+                    respond = QUERY_TYPE_RESPONDERS.get(query_type)
+                    if respond:
+                        return respond(chat_state, user_question)
                     
                     # Inherit specified parameters from last successful query
                     # This applies to BOTH FOLLOW_UP and NEW_QUERY!
@@ -1242,6 +1839,7 @@ def run_sql_rag_agent(user_question: str, connection_string: str, chat_state: Ch
                     
                     # Capture overrides from context analysis
                     override_hints = context_data.get("override_params", {})
+                    query_family = context_data.get("query_family")
                     
                     # Mark as follow-up only for FOLLOW_UP type (affects query reuse)
                     if query_type == "FOLLOW_UP":
@@ -1256,16 +1854,16 @@ def run_sql_rag_agent(user_question: str, connection_string: str, chat_state: Ch
                     # CODE-LEVEL OVERRIDE: Detect product ↔ salesperson switches
                     # LLM sometimes fails to detect these, so we force NEW_QUERY behavior
                     # ========================================
-                    msg_lower = user_question.lower()
-                    last_qid = chat_state.last_query_id or ""
+                    msg_lower = question_lower
+                    last_qid = (chat_state.last_query_id or "").lower()
                     
                     # Detect if user is asking for salesperson but was on product query
-                    asks_salesperson = any(kw in msg_lower for kw in ["salesperson", "who generated", "who made", "rank sales", "best performer", "top performer"])
-                    was_product = "product_segment" in last_qid.lower()
+                    asks_salesperson = bool(SALESPERSON_REQUEST_PATTERN.search(msg_lower))
+                    was_product = "product_segment" in last_qid
                     
                     # Detect if user is asking for product but was on salesperson query
-                    asks_product = any(kw in msg_lower for kw in ["product type", "product segment", "which product"])
-                    was_salesperson = any(kw in last_qid.lower() for kw in ["salesperson", "category_performance", "category_specific"])
+                    asks_product = bool(PRODUCT_REQUEST_PATTERN.search(msg_lower))
+                    was_salesperson = bool(SALESPERSON_QUERY_ID_PATTERN.search(last_qid))
                     
                     if (asks_salesperson and was_product) or (asks_product and was_salesperson):
                         print(f"[DEBUG] CODE OVERRIDE: Detected query subject change, forcing NEW_QUERY behavior")
@@ -1287,8 +1885,9 @@ def run_sql_rag_agent(user_question: str, connection_string: str, chat_state: Ch
             if is_follow_up and chat_state.last_query_id and chat_state.last_query_context:
                 # SAFETY CHECK: Verify query type matches current question subject
                 # Don't reuse a PRODUCT query for a PERSON question (or vice versa)
-                last_was_product = 'product' in chat_state.last_query_id.lower() or 'segment' in chat_state.last_query_id.lower()
-                current_asks_person = any(word in user_question.lower() for word in ['who', 'salesperson', 'performer', 'executive', 'sales rep'])
+                last_qid = chat_state.last_query_id.lower()
+                last_was_product = 'product' in last_qid or 'segment' in last_qid
+                current_asks_person = bool(PERSON_WORDS_PATTERN.search(question_lower))
                 
                 if last_was_product and current_asks_person:
                     # Subject mismatch! Force semantic search
@@ -1313,7 +1912,7 @@ def run_sql_rag_agent(user_question: str, connection_string: str, chat_state: Ch
             
             if do_semantic_search:
                 # NEW QUERY or MISMATCH: Do semantic search
-                qid, sql_template, req, opt, defaults = semantic_search_sql(user_question)
+                qid, sql_template, req, opt, defaults = semantic_search_sql(user_question, family=query_family)
 
                 chat_state.pending_query_id = qid
                 chat_state.last_query_template = sql_template
@@ -1324,7 +1923,7 @@ def run_sql_rag_agent(user_question: str, connection_string: str, chat_state: Ch
             
             # Pre-populate with inherited params from context analysis
             chat_state.collected_params = inherited_params.copy()
-            chat_state.collected_params.update(override_hints)
+            chat_state.collected_params.update((sys.intern(k), v) for k, v in override_hints.items())
             
             # MUTUAL EXCLUSION: Location filters replace each other (state/cso/cluster)
             # If user specifies one, remove the others from persistent filters
@@ -1349,10 +1948,6 @@ def run_sql_rag_agent(user_question: str, connection_string: str, chat_state: Ch
                         chat_state.collected_params[filter_key] = filter_val
                         print(f"[DEBUG] Auto-inherited filter: {filter_key}={filter_val}")
             
-            # Get required params (need to fetch again for follow-ups)
-            if is_follow_up:
-                _, _, req, _, _ = semantic_search_sql(chat_state.last_query_context)
-            
             # Calculate truly missing params (not in inherited or overrides)
             chat_state.missing_params = [p for p in req if p not in chat_state.collected_params]
 
@@ -1360,42 +1955,33 @@ def run_sql_rag_agent(user_question: str, connection_string: str, chat_state: Ch
             # This ensures "top 5" is always captured regardless of query type
             
             # Check if user explicitly mentions a time period (should override inherited dates)
-            lower_q = user_question.lower()
-            has_explicit_time = any(phrase in lower_q for phrase in [
-                'last month', 'last year', 'last quarter', 'this month', 'this year',
-                'previous month', 'previous year', 'previous quarter',
-                'january', 'february', 'march', 'april', 'may', 'june',
-                'july', 'august', 'september', 'october', 'november', 'december'
-            ])
+            has_explicit_time = bool(EXPLICIT_TIME_PATTERN.search(question_lower))
             
-            for p in req + opt:
-                # For 'n' and 'sort', ALWAYS try to extract from explicit user input
-                # to override Context Analyzer defaults when user says "top 5" explicitly
-                should_override = p in ['n', 'sort']
-                
-                # Also override dates when user explicitly mentions a time period
-                if has_explicit_time and p in ['start_date', 'end_date']:
-                    should_override = True
-                
-                if p not in chat_state.collected_params or should_override:
-                    val = extract_from_original_question(user_question, p)
-                    if val is not None:
-                        chat_state.collected_params[p] = val
-                        print(f"[DEBUG] Extracted from question: {p}={val}")
-                        if p in chat_state.missing_params:
-                            chat_state.missing_params.remove(p)
+            # Params to fill from the question: anything not yet collected, plus
+            # 'n'/'sort' (ALWAYS taken from explicit user input to override Context
+            # Analyzer defaults when user says "top 5") and dates when a period is named
+            to_extract = [
+                p for p in req + opt
+                if p not in chat_state.collected_params
+                or p in ('n', 'sort')
+                or (has_explicit_time and p in ('start_date', 'end_date'))
+            ]
+            for p, val in extract_all_params(user_question, to_extract, lower_q=question_lower).items():
+                chat_state.collected_params[p] = val
+                print(f"[DEBUG] Extracted from question: {p}={val}")
+                if p in chat_state.missing_params:
+                    chat_state.missing_params.remove(p)
 
             # ========================================
             # EXPORT DETECTION (runs for all queries including follow-ups)
             # ========================================
-            mentions_export = "export" in user_question.lower() or override_hints.get("business_type") == "export" or override_hints.get("segment") == "export" or override_hints.get("sales_type") == "export"
+            mentions_export = "export" in question_lower or override_hints.get("business_type") == "export" or override_hints.get("segment") == "export" or override_hints.get("sales_type") == "export"
             if mentions_export and "export" not in chat_state.pending_query_id:
                 # Check if user mentioned a specific category
                 has_category = "business_category" in chat_state.collected_params or "business_category" in override_hints
                 
-                # First try QUERY_VARIANTS mapping
-                export_key = f"{chat_state.pending_query_id}|export"
-                export_query_id = QUERY_VARIANTS.get(export_key)
+                # First try QUERY_VARIANTS_MODE mapping
+                export_query_id = QUERY_VARIANTS_MODE.get(chat_state.pending_query_id, {}).get("export")
                 
                 # Special case: product_segment_domestic + category → product_segment_export_by_category
                 if has_category and chat_state.pending_query_id == "product_segment_domestic":
@@ -1404,38 +1990,25 @@ def run_sql_rag_agent(user_question: str, connection_string: str, chat_state: Ch
                 if export_query_id:
                     print(f"[DEBUG] EXPORT DETECTED: Switching from '{chat_state.pending_query_id}' to '{export_query_id}'")
                     # Fetch the export query template directly by ID (no semantic search)
-                    try:
-                        _, sql_template, req, opt, defaults = get_query_by_id(export_query_id)
-                        chat_state.pending_query_id = export_query_id
-                        chat_state.last_query_template = sql_template
-                        chat_state.optional_params = opt
-                        chat_state.param_defaults = defaults
+                    req = switch_pending_query(chat_state, export_query_id, "Export query")
+                    if req is not None:
                         # Recalculate missing params for the new query
                         chat_state.missing_params = [p for p in req if p not in chat_state.collected_params]
-                    except ValueError as e:
-                        print(f"[DEBUG] Export query switch failed: {e}")
 
             # ========================================
             # DOMESTIC DETECTION (switch from export to domestic)
             # ========================================
-            mentions_domestic = "domestic" in user_question.lower() or override_hints.get("sales_type") in ["domestic", "'domestic'"]
+            mentions_domestic = "domestic" in question_lower or override_hints.get("sales_type") in ["domestic", "'domestic'"]
             if mentions_domestic and "export" in chat_state.pending_query_id:
                 # User wants domestic - switch from export to domestic query
-                domestic_key = f"{chat_state.pending_query_id}|domestic"
-                domestic_query_id = QUERY_VARIANTS.get(domestic_key)
+                domestic_query_id = QUERY_VARIANTS_MODE.get(chat_state.pending_query_id, {}).get("domestic")
                 
                 if domestic_query_id:
                     print(f"[DEBUG] DOMESTIC DETECTED: Switching from '{chat_state.pending_query_id}' to '{domestic_query_id}'")
-                    try:
-                        _, sql_template, req, opt, defaults = get_query_by_id(domestic_query_id)
-                        chat_state.pending_query_id = domestic_query_id
-                        chat_state.last_query_template = sql_template
-                        chat_state.optional_params = opt
-                        chat_state.param_defaults = defaults
+                    req = switch_pending_query(chat_state, domestic_query_id, "Domestic query")
+                    if req is not None:
                         # Recalculate missing params for the new query
                         chat_state.missing_params = [p for p in req if p not in chat_state.collected_params]
-                    except ValueError as e:
-                        print(f"[DEBUG] Domestic query switch failed: {e}")
 
         # ========================================
         # 5️⃣ PARAMETER COLLECTION (Enhanced with context)
@@ -1443,27 +2016,30 @@ def run_sql_rag_agent(user_question: str, connection_string: str, chat_state: Ch
         while chat_state.missing_params:
             chat_state.increment_attempts()
 
-            llm_input = {
-                "missing_params": ", ".join(chat_state.missing_params),
-                "collected_params": json.dumps(chat_state.collected_params),
-                "optional_params": ", ".join(chat_state.optional_params),
-                "original_question": chat_state.original_question,
-                "current_date": datetime.now().strftime("%Y-%m-%d"),
-                "question": user_question,
-                # NEW: Pass inherited context to parameter extractor
-                "inherited_params": json.dumps(inherited_params),
-                "override_hints": json.dumps(override_hints)
-            }
+            # Rules first: when they cover every missing param, skip the LLM round-trip
+            extracted = extract_deterministic_params(user_question, chat_state.missing_params, lower_q=question_lower)
+            if any(p not in extracted for p in chat_state.missing_params):
+                llm_input = {
+                    "missing_params": ", ".join(chat_state.missing_params),
+                    "collected_params": json.dumps(chat_state.collected_params),
+                    "optional_params": ", ".join(chat_state.optional_params),
+                    "original_question": chat_state.original_question,
+                    "current_date": datetime.now().strftime("%Y-%m-%d"),
+                    "question": user_question,
+                    # NEW: Pass inherited context to parameter extractor
+                    "inherited_params": json.dumps(inherited_params),
+                    "override_hints": json.dumps(override_hints)
+                }
 
-            extraction = PARAMETER_EXTRACTION_CHAIN.invoke(llm_input)
-            extracted = json.loads(extraction)
+                extraction = get_parameter_extraction_chain().invoke(llm_input)
+                extracted = json.loads(extraction)
 
-            # Direct check for "all" in business_category clarification
-            if "business_category" in chat_state.missing_params:
-                user_lower = user_question.lower().strip()
-                if user_lower in ["all", "all categories", "everything", "all of them"]:
-                    extracted["business_category"] = "'FMEG', 'Wiring Devices & Switchgear', 'Wires & Cables'"
+                # Direct check for "all" in business_category clarification
+                if "business_category" in chat_state.missing_params and question_lower.strip() in ALL_CATEGORY_ANSWERS:
+                    extracted["business_category"] = ALL_BUSINESS_CATEGORIES
                     print(f"[DEBUG] Direct 'all' detected for business_category - setting all 3 categories")
+            else:
+                print(f"[DEBUG] Missing params resolved by rules, skipping LLM extraction: {extracted}")
 
             # Merge extracted params safely
             merge_params_safely(chat_state.collected_params, extracted)
@@ -1476,24 +2052,16 @@ def run_sql_rag_agent(user_question: str, connection_string: str, chat_state: Ch
             bc_value = str(chat_state.collected_params.get("business_category", "")).lower().strip()
             if bc_value in ["all", "'all'", "all categories", "everything"]:
                 # User wants all categories - set all 3 business categories
-                chat_state.collected_params["business_category"] = "'FMEG', 'Wiring Devices & Switchgear', 'Wires & Cables'"
+                chat_state.collected_params["business_category"] = ALL_BUSINESS_CATEGORIES
                 print(f"[DEBUG] 'all' detected - setting all business categories")
             
             # Detect "export" keyword → switch to export query variant
-            if "export" in user_question.lower() and "domestic" not in user_question.lower():
-                export_key = f"{chat_state.pending_query_id}|export"
-                export_query_id = QUERY_VARIANTS.get(export_key)
+            if "export" in question_lower and "domestic" not in question_lower:
+                export_query_id = QUERY_VARIANTS_MODE.get(chat_state.pending_query_id, {}).get("export")
                 if export_query_id and export_query_id != chat_state.pending_query_id:
                     print(f"[DEBUG] Switching from '{chat_state.pending_query_id}' to export query '{export_query_id}'")
                     # Fetch the export query template directly by ID
-                    try:
-                        _, sql_template, req, opt, defaults = get_query_by_id(export_query_id)
-                        chat_state.pending_query_id = export_query_id
-                        chat_state.last_query_template = sql_template
-                        chat_state.optional_params = opt
-                        chat_state.param_defaults = defaults
-                    except ValueError as e:
-                        print(f"[DEBUG] Export query switch failed: {e}")
+                    switch_pending_query(chat_state, export_query_id, "Export query")
 
             chat_state.missing_params = [
                 p for p in chat_state.missing_params
@@ -1528,14 +2096,7 @@ def run_sql_rag_agent(user_question: str, connection_string: str, chat_state: Ch
         
         if best_query and best_query != chat_state.pending_query_id:
             print(f"[DEBUG] Query doesn't support all filters. Switching: '{chat_state.pending_query_id}' → '{best_query}'")
-            try:
-                _, sql_template, req, opt, defaults = get_query_by_id(best_query)
-                chat_state.pending_query_id = best_query
-                chat_state.last_query_template = sql_template
-                chat_state.optional_params = opt
-                chat_state.param_defaults = defaults
-            except ValueError as e:
-                print(f"[DEBUG] Query switch failed, using original: {e}")
+            switch_pending_query(chat_state, best_query, "Query (keeping original)")
 
         # ========================================
         # 7️⃣ EXECUTION
@@ -1550,21 +2111,16 @@ def run_sql_rag_agent(user_question: str, connection_string: str, chat_state: Ch
         print(f"[DEBUG] Executing Query ID: {chat_state.pending_query_id}")
         print(f"[DEBUG] Final SQL: {final_sql}")
 
-        columns, rows = execute_sql_query_from_string(connection_string, final_sql)
-
         # ========================================
         # 8️⃣ RESPONSE GENERATION
         # ========================================
         # Determine question context for response generation
         response_question = user_question
         
-        # Import regex for ordinal detection
-        import re
-        ordinal_pattern = r'\b\d+(st|nd|rd|th)\b'  # Matches 1st, 2nd, 3rd, 4th, 5th, etc.
-        has_true_ordinal = bool(re.search(ordinal_pattern, user_question.lower()))
+        has_true_ordinal = bool(ORDINAL_PATTERN.search(question_lower))
         
         # Check if user_question is a short response (likely clarification or follow-up modifier)
-        words = user_question.lower().split()
+        words = question_lower.split()
         is_short_response = len(words) <= 5
         
         # Get current sort direction for accurate response
@@ -1583,7 +2139,7 @@ def run_sql_rag_agent(user_question: str, connection_string: str, chat_state: Ch
         # Case 2: Clarification - user answered a parameter question
         # original_question is set, but this isn't a follow-up (first query's param collection)
         elif not is_follow_up and chat_state.original_question and is_short_response:
-            if chat_state.original_question.lower() != user_question.lower():
+            if chat_state.original_question.lower() != question_lower:
                 response_question = f"{chat_state.original_question} ({user_question})"
                 print(f"[DEBUG] Combined question for response (clarification): {response_question}")
         
@@ -1627,24 +2183,42 @@ def run_sql_rag_agent(user_question: str, connection_string: str, chat_state: Ch
         query_context = " | ".join(context_parts) if context_parts else "No specific filters"
         print(f"[DEBUG] Query Context: {query_context}")
         
-        # Pre-format currency values before sending to LLM
-        # This is CRITICAL - LLMs cannot reliably do arithmetic!
-        formatted_rows = preformat_currency_in_rows(columns, rows)
+        # Same (or reworded) question for the same SQL: reuse the answer and rows instead of DB + LLM.
+        # Today's date is part of the key: relative periods ("today", "this month") roll over at midnight.
+        result_key = (final_sql, query_context, date.today())
+        cached_response, answer_reusable = lookup_cached_response(result_key, response_question)
         
-        llm_input = {
-            "columns": str(columns),
-            "rows": str(formatted_rows),
-            "question": response_question,
-            "query_context": query_context
-        }
+        if answer_reusable:
+            answer, columns, rows = cached_response.answer, cached_response.columns, cached_response.rows
+            print(f"[DEBUG] Response cache hit (cached question: '{cached_response.question}')")
+        else:
+            if cached_response is not None:
+                # Reworded question over the same SQL: reuse the rows, phrase a new answer
+                columns, rows = cached_response.columns, cached_response.rows
+                print(f"[DEBUG] Result cache hit, rephrasing for this question")
+            else:
+                columns, rows = execute_sql_query_from_string(connection_string, final_sql)
+            
+            # Pre-format currency values before sending to LLM
+            # This is CRITICAL - LLMs cannot reliably do arithmetic!
+            formatted_rows = preformat_currency_in_rows(columns, rows)
+            
+            llm_input = {
+                "columns": str(columns),
+                "rows": format_rows_for_prompt(formatted_rows),
+                "question": response_question,
+                "query_context": query_context
+            }
 
-        answer = (input_format | AGENT_PROMPT | LLM | StrOutputParser()).invoke(llm_input)
+            answer = get_answer_chain().invoke(llm_input)
+            store_cached_response(result_key, response_question, answer, columns, rows)
 
         # ========================================
         # 9️⃣ SAVE CONTEXT FOR NEXT TURN
         # ========================================
-        chat_state.last_columns = columns
-        chat_state.last_rows = rows
+        # Copies: cached rows are shared with every conversation that hits the cache
+        chat_state.last_columns = list(columns)
+        chat_state.last_rows = [list(row) for row in rows]
         
         # Save successful query context for follow-ups
         chat_state.save_successful_query(
@@ -1,9 +1,16 @@
+import numpy as np
 import pyodbc
-from typing import List, Tuple, Dict, Any
-from chromadb import PersistentClient
+from typing import List, Tuple, Dict, Any, Optional, Sequence
+from chromadb import PersistentClient, EmbeddingFunction
 from chromadb.utils import embedding_functions
 import json
 import os
+import re
+from functools import lru_cache
+from queue import Queue, Empty, Full
+from threading import Lock
+from collections import OrderedDict
+from time import monotonic
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
@@ -26,8 +33,23 @@ ROUTER_LLM = ChatGroq(
 )
 
 
+ROUTER_FAMILIES = ("CSO", "PRODUCT", "EXPORT", "DOMESTIC", "STATE", "CATEGORY", "GENERAL")
+
+# Shared with the context analyzer in agent.py, which returns the same label
+# as "query_family" so new queries can skip the separate router call
+ROUTER_RULES = """Routing Rules (apply in this priority order):
+
+1) If the question contains a CSO code (e.g. DCBH01, CSO123) OR the word 'CSO' → CSO
+2) If the question is about products, product types, SKUs, items, or product performance → PRODUCT
+3) If the question contains the word export or exports → EXPORT
+4) If the question contains the word domestic → DOMESTIC
+5) If the question mentions any Indian state name or standard state code → STATE
+6) CRITICAL: If the question mentions 'salesperson', 'who generated', 'rank', 'performer', (about people, not products) → GENERAL
+7) If the question mentions a business category (FMEG, wires, cables, switchgear, wiring devices, etc) → CATEGORY
+8) Otherwise → GENERAL"""
+
 ROUTER_PROMPT = ChatPromptTemplate.from_messages([
-    ("system", """
+    ("system", f"""
 You are a query routing classifier for a sales analytics system.
 
 Return exactly ONE label:
@@ -39,16 +61,7 @@ STATE
 CATEGORY
 GENERAL
 
-Routing Rules (apply in this priority order):
-
-1) If the question contains a CSO code (e.g. DCBH01, CSO123) OR the word 'CSO' → CSO
-2) If the question is about products, product types, SKUs, items, or product performance → PRODUCT
-3) If the question contains the word export or exports → EXPORT
-4) If the question contains the word domestic → DOMESTIC
-5) If the question mentions any Indian state name or standard state code → STATE
-6) CRITICAL: If the question mentions 'salesperson', 'who generated', 'rank', 'performer', (about people, not products) → GENERAL
-7) If the question mentions a business category (FMEG, wires, cables, switchgear, wiring devices, etc) → CATEGORY
-8) Otherwise → GENERAL
+{ROUTER_RULES}
 
 Return only the label.
 """),
@@ -64,48 +77,183 @@ ROUTER_CHAIN = ROUTER_PROMPT | ROUTER_LLM | StrOutputParser()
 
 EMBEDDING_MODEL_NAME = "sentence-transformers/paraphrase-albert-small-v2"
 
-EMBEDDINGS = embedding_functions.SentenceTransformerEmbeddingFunction(
-    model_name=EMBEDDING_MODEL_NAME
-)
+# Directory holding an int8 ONNX export of EMBEDDING_MODEL_NAME (model_quantized.onnx
+# plus its tokenizer files). Unset → the regular FP32 SentenceTransformer model.
+EMBEDDING_ONNX_DIR = os.getenv("EMBEDDING_ONNX_DIR")
+EMBEDDING_MAX_TOKENS = 128
+
+
+class OnnxEmbeddingFunction(EmbeddingFunction):
+    """
+    Mean-pooled sentence embeddings from a quantized ONNX export of the same model,
+    run on onnxruntime's CPU provider instead of PyTorch.
+    """
+
+    def __init__(self, model_dir: str):
+        import onnxruntime
+        from transformers import AutoTokenizer
+
+        self._tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self._session = onnxruntime.InferenceSession(
+            os.path.join(model_dir, "model_quantized.onnx"),
+            providers=["CPUExecutionProvider"]
+        )
+        self._input_names = [i.name for i in self._session.get_inputs()]
+
+    def __call__(self, input: List[str]) -> List[List[float]]:
+        encoded = self._tokenizer(
+            list(input), padding=True, truncation=True,
+            max_length=EMBEDDING_MAX_TOKENS, return_tensors="np"
+        )
+        token_embeddings = self._session.run(None, {name: encoded[name] for name in self._input_names})[0]
+        # Mean pooling over real tokens, matching the model's SentenceTransformer pooling layer
+        mask = encoded["attention_mask"][..., None].astype(np.float32)
+        pooled = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        return pooled.tolist()
+
+
+def _load_embeddings():
+    if EMBEDDING_ONNX_DIR:
+        try:
+            return OnnxEmbeddingFunction(EMBEDDING_ONNX_DIR)
+        except Exception as e:
+            # Missing packages, unreadable tokenizer files, or onnxruntime's own load errors
+            # (NoSuchFile, InvalidGraph, ...) all fall back to the regular model
+            print(f"[WARNING] ONNX embeddings unavailable ({type(e).__name__}: {e}), using SentenceTransformer")
+    return embedding_functions.SentenceTransformerEmbeddingFunction(
+        model_name=EMBEDDING_MODEL_NAME
+    )
+
+
+EMBEDDINGS = _load_embeddings()
 
 CHROMA_CLIENT = PersistentClient(path="./chroma_db_data")
 COLLECTION_NAME = "sql_query_store"
 
+_QUERY_COLLECTION = None
+
+
+def _collection():
+    """Module-level handle to the query store, bound once to EMBEDDINGS."""
+    global _QUERY_COLLECTION
+    if _QUERY_COLLECTION is None:
+        _QUERY_COLLECTION = CHROMA_CLIENT.get_or_create_collection(
+            name=COLLECTION_NAME,
+            embedding_function=EMBEDDINGS
+        )
+    return _QUERY_COLLECTION
+
 
 # =========================
 # 🔹 SQL EXECUTION
 # =========================
 
-def execute_sql_query_from_string(connection_string: str, sql_query: str) -> Tuple[List[str], List[List]]:
-    guardrail = ["INSERT", "UPDATE", "DELETE", "DROP", "CREATE", "ALTER", "TRUNCATE"]
-    q = sql_query.strip().upper()
+# Whole-word match so identifiers like updated_at / created_by don't trip the guardrail
+GUARDRAIL_PATTERN = re.compile(r"\b(?:INSERT|UPDATE|DELETE|DROP|CREATE|ALTER|TRUNCATE|EXEC(?:UTE)?|MERGE)\b", re.IGNORECASE)
+SELECT_PREFIX_PATTERN = re.compile(r"\s*(?:WITH|SELECT)\b", re.IGNORECASE)
+# Anything after a ';' is a second statement; only a trailing ';' is allowed
+STATEMENT_CHAIN_PATTERN = re.compile(r";\s*\S")
+
+SQL_POOL_SIZE = 8
+SQL_FETCH_CHUNK_SIZE = 1000
+# Errors meaning the connection itself is unusable; anything else is the statement's fault
+SQL_CONNECTION_ERRORS = (pyodbc.OperationalError, pyodbc.InterfaceError)
+
+# Open connections per connection string; reused across queries to skip the TCP + AAD handshake
+_POOL: Dict[str, Queue] = {}
+_POOL_LOCK = Lock()
 
-    if any(word in q for word in guardrail) or not q.startswith("SELECT"):
-        raise ValueError("SQL Guardrail Violated")
 
-    cnxn = pyodbc.connect(connection_string)
+def _get_pool(connection_string: str) -> Queue:
+    with _POOL_LOCK:
+        pool = _POOL.get(connection_string)
+        if pool is None:
+            pool = _POOL[connection_string] = Queue(maxsize=SQL_POOL_SIZE)
+        return pool
+
+
+def _release_connection(pool: Queue, cnxn):
+    """Returns a healthy connection to the pool, or closes it if the pool is full."""
     try:
-        cursor = cnxn.cursor()
-        cursor.execute(sql_query)
+        pool.put_nowait(cnxn)
+    except Full:
+        cnxn.close()
+
+
+def _run_query(cnxn, sql_query: str, params: Sequence[Any]) -> Tuple[List[str], List[List]]:
+    cursor = cnxn.cursor()
+    try:
+        # '?' placeholders bound by the driver: same SQL text across values, so the plan is reused
+        if params:
+            cursor.execute(sql_query, params)
+        else:
+            cursor.execute(sql_query)
         columns = [c[0] for c in cursor.description]
-        rows = [list(r) for r in cursor.fetchall()]
+        # Copy rows chunk by chunk: fetchall() would hold every pyodbc Row alongside the list copies
+        rows = []
+        while True:
+            batch = cursor.fetchmany(SQL_FETCH_CHUNK_SIZE)
+            if not batch:
+                break
+            rows.extend(list(r) for r in batch)
         return columns, rows
     finally:
-        cnxn.close()
+        cursor.close()
+
+
+def execute_sql_query_from_string(connection_string: str, sql_query: str, params: Sequence[Any] = ()) -> Tuple[List[str], List[List]]:
+    if (
+        GUARDRAIL_PATTERN.search(sql_query)
+        or STATEMENT_CHAIN_PATTERN.search(sql_query)
+        or not SELECT_PREFIX_PATTERN.match(sql_query)
+    ):
+        raise ValueError("SQL Guardrail Violated")
+
+    pool = _get_pool(connection_string)
+    try:
+        cnxn = pool.get_nowait()
+        pooled = True
+    except Empty:
+        cnxn = pyodbc.connect(connection_string, autocommit=True)
+        pooled = False
+
+    while True:
+        try:
+            result = _run_query(cnxn, sql_query, params)
+            break
+        except SQL_CONNECTION_ERRORS:
+            cnxn.close()
+            if not pooled:
+                raise
+            # Idle pooled connection may have been dropped server-side: retry once on a fresh one
+            cnxn = pyodbc.connect(connection_string, autocommit=True)
+            pooled = False
+        except pyodbc.Error:
+            # Statement-level failure (syntax, bad column, permissions): the connection is still good
+            _release_connection(pool, cnxn)
+            raise
+        except BaseException:
+            cnxn.close()
+            raise
+
+    _release_connection(pool, cnxn)
+    return result
 
 
 # =========================
 # 🔹 VECTOR DB MANAGEMENT
 # =========================
 
+SEED_BATCH_SIZE = 250  # documents per upsert when seeding
+
+# query_id -> (sql, parameters, optional_parameters, defaults), filled when the store is seeded
+_QUERY_REGISTRY: Dict[str, Tuple[str, Tuple[str, ...], Tuple[str, ...], Dict[str, Any]]] = {}
+
 def initialize_vector_db(query_file_path: str = "queries_optimized.json"):
     with open(query_file_path) as f:
         queries = json.load(f)
 
-    collection = CHROMA_CLIENT.get_or_create_collection(
-        name=COLLECTION_NAME,
-        embedding_function=EMBEDDINGS
-    )
+    collection = _collection()
 
     ids = [q["id"] for q in queries]
     docs = [q["question"] for q in queries]
@@ -114,160 +262,345 @@ def initialize_vector_db(query_file_path: str = "queries_optimized.json"):
         "sql_query": q["sql"],
         "parameters": json.dumps(q.get("parameters", [])),
         "optional_parameters": json.dumps(q.get("optional_parameters", [])),
-        "defaults": json.dumps(q.get("defaults", {}))
+        "defaults": json.dumps(q.get("defaults", {})),
+        **query_family_flags(q["id"])
     } for q in queries]
 
-    collection.upsert(documents=docs, metadatas=metas, ids=ids)
+    # One embedding pass for the whole file, then bounded upserts so large query files stay within Chroma's batch limits
+    embeddings = EMBEDDINGS(docs) if docs else []
+    for start in range(0, len(ids), SEED_BATCH_SIZE):
+        end = start + SEED_BATCH_SIZE
+        collection.upsert(
+            ids=ids[start:end],
+            documents=docs[start:end],
+            embeddings=embeddings[start:end],
+            metadatas=metas[start:end]
+        )
+    _load_query.cache_clear()
+    clear_route_cache()
+    _load_template_index()
+    _QUERY_REGISTRY.update(
+        (q["id"], (
+            q["sql"],
+            tuple(q.get("parameters", [])),
+            tuple(q.get("optional_parameters", [])),
+            q.get("defaults", {})
+        ))
+        for q in queries
+    )
     print(f"SUCCESS: Synced {len(ids)} SQL queries")
 
 
-def get_query_by_id(query_id: str) -> Tuple[str, str, List[str], List[str], Dict[str, Any]]:
-    """
-    Fetch a specific query by its ID directly from ChromaDB.
-    Used for query switching without re-running semantic search.
-    """
-    collection = CHROMA_CLIENT.get_collection(
-        name=COLLECTION_NAME,
-        embedding_function=EMBEDDINGS
-    )
-    
-    result = collection.get(ids=[query_id], include=["metadatas"])
-    
+@lru_cache(maxsize=256)
+def _load_query(query_id: str) -> Tuple[str, Tuple[str, ...], Tuple[str, ...], Dict[str, Any]]:
+    result = _collection().get(ids=[query_id], include=["metadatas"])
+
     if not result["ids"]:
         raise ValueError(f"Query ID '{query_id}' not found in ChromaDB")
-    
+
     meta = result["metadatas"][0]
     return (
-        query_id,
         meta["sql_query"],
-        json.loads(meta.get("parameters", "[]")),
-        json.loads(meta.get("optional_parameters", "[]")),
+        tuple(json.loads(meta.get("parameters", "[]"))),
+        tuple(json.loads(meta.get("optional_parameters", "[]"))),
         json.loads(meta.get("defaults", "{}"))
     )
 
 
+def get_query_by_id(query_id: str) -> Tuple[str, str, List[str], List[str], Dict[str, Any]]:
+    """
+    Fetch a specific query by its ID directly from ChromaDB.
+    Used for query switching without re-running semantic search.
+    Served from the seeded registry; ChromaDB is only hit for IDs seeded elsewhere.
+    """
+    entry = _QUERY_REGISTRY.get(query_id)
+    sql, params, optional, defaults = entry if entry is not None else _load_query(query_id)
+    # Fresh containers: callers store these on ChatState and may mutate them
+    return query_id, sql, list(params), list(optional), dict(defaults)
+
+
 # =========================
 # 🧠 HYBRID ROUTING + SEARCH
 # =========================
 
-def semantic_search_sql(user_query: str, k: int = 1) -> Tuple[str, str, List[str], List[str], Dict[str, Any]]:
+INDIAN_STATES = [
+    "andhra pradesh", "arunachal pradesh", "assam", "bihar", "chhattisgarh",
+    "goa", "gujarat", "haryana", "himachal pradesh", "jharkhand", "karnataka",
+    "kerala", "madhya pradesh", "maharashtra", "manipur", "meghalaya", "mizoram",
+    "nagaland", "odisha", "punjab", "rajasthan", "sikkim", "tamil nadu",
+    "telangana", "tripura", "uttar pradesh", "uttarakhand", "west bengal",
+    "delhi", "jammu", "kashmir"
+]
 
-    collection = CHROMA_CLIENT.get_collection(
-        name=COLLECTION_NAME,
-        embedding_function=EMBEDDINGS
-    )
+STATE_CODES = ["ap","ar","as","br","cg","ga","gj","hr","hp","jh","ka","kl","mp","mh",
+            "mn","ml","mz","nl","or","pb","rj","sk","tn","ts","tr","up","uk","wb","dl"]
 
-    # 1️⃣ LLM Routing
-    family = ROUTER_CHAIN.invoke({"question": user_query}).strip().upper()
-    print(f"[DEBUG] LLM Query Family: {family}")
-
-    q_lower = " " + user_query.lower() + " "
+CSO_CODE_PREFIXES = ["DCBH", "DCMH", "DCRJ"]  # Common CSO prefixes
 
-    INDIAN_STATES = [
-        "andhra pradesh", "arunachal pradesh", "assam", "bihar", "chhattisgarh",
-        "goa", "gujarat", "haryana", "himachal pradesh", "jharkhand", "karnataka",
-        "kerala", "madhya pradesh", "maharashtra", "manipur", "meghalaya", "mizoram",
-        "nagaland", "odisha", "punjab", "rajasthan", "sikkim", "tamil nadu",
-        "telangana", "tripura", "uttar pradesh", "uttarakhand", "west bengal",
-        "delhi", "jammu", "kashmir"
-    ]
-
-    STATE_CODES = ["ap","ar","as","br","cg","ga","gj","hr","hp","jh","ka","kl","mp","mh",
-                "mn","ml","mz","nl","or","pb","rj","sk","tn","ts","tr","up","uk","wb","dl"]
-
-    mentions_state = any(f" {s} " in q_lower for s in INDIAN_STATES) or \
-                    any(f" {c} " in q_lower for c in STATE_CODES)
-
-
-    all_data = collection.get(include=["documents", "metadatas"])
-    all_ids = collection.get()["ids"]
-
-    allowed_docs, allowed_meta, allowed_ids = [], [], []
-
-    for doc, meta, qid in zip(all_data["documents"], all_data["metadatas"], all_ids):
-        qid_l = qid.lower()
-        if family == "CSO" and "cso" not in qid_l:
-           continue
-        if family == "PRODUCT" and "product" not in qid_l:
-            continue
-        if family == "EXPORT" and "export" not in qid_l:
-            continue
-        if family == "DOMESTIC" and "domestic" not in qid_l:
-            continue
-        if family == "STATE" and not mentions_state:
-            continue
-        if family == "CATEGORY" and "category" not in qid_l:
-            continue
-        
-        # GENERAL family: exclude specialized queries that require specific filters
-        if family == "GENERAL":
-            # Exclude product_segment queries (those are for PRODUCT family)
-            if "product_segment" in qid_l:
-                continue
-            # Exclude state-specific queries unless user mentioned a state
-            if "by_state" in qid_l or "state_category" in qid_l:
-                if not mentions_state:
-                    continue
-            # Exclude CSO-specific queries unless user mentioned CSO
-            if "by_cso" in qid_l or "cso_category" in qid_l:
-                mentions_cso = "cso" in user_query.lower() or any(
-                    code in user_query.upper() for code in ["DCBH", "DCMH", "DCRJ"]  # Common CSO prefixes
-                )
-                if not mentions_cso:
-                    continue
-        
-        # Prefer domestic over export unless explicitly mentioned
-        mentions_export = "export" in user_query.lower()
-        if not mentions_export and "export" in qid_l and family == "PRODUCT":
-            continue
-
-        allowed_docs.append(doc)
-        allowed_meta.append(meta)
-        allowed_ids.append(qid)
-
-    if not allowed_docs:
-        allowed_docs, allowed_meta, allowed_ids = all_data["documents"], all_data["metadatas"], all_ids
-
-    # 2️⃣ Safe Temporary Collection
-    temp_name = "router_tmp"
-
-    try:
-        CHROMA_CLIENT.delete_collection(temp_name)
-    except:
-        pass
-
-    temp = CHROMA_CLIENT.create_collection(name=temp_name, embedding_function=EMBEDDINGS)
+# One scan each over the space-padded, lowercased question, instead of ~60 `in` checks.
+# The lookarounds keep the old " name " rule: a mention must be space-delimited.
+STATE_MENTION_PATTERN = re.compile(
+    r"(?<= )(?:" + "|".join(map(re.escape, INDIAN_STATES + STATE_CODES)) + r")(?= )"
+)
+CSO_MENTION_PATTERN = re.compile("|".join(map(re.escape, ["cso"] + [p.lower() for p in CSO_CODE_PREFIXES])))
 
-    try:
-        temp.upsert(documents=allowed_docs, metadatas=allowed_meta, ids=allowed_ids)
 
-        results = temp.query(
-            query_texts=[user_query],
-            n_results=k,
-            include=["metadatas"]
-        )
+def query_family_flags(query_id: str) -> Dict[str, bool]:
+    """
+    Boolean metadata stored with each template so routing can filter with a
+    Chroma `where` clause instead of scanning query IDs in Python.
+    """
+    qid_l = query_id.lower()
+    return {
+        "is_cso": "cso" in qid_l,
+        "is_product": "product" in qid_l,
+        "is_export": "export" in qid_l,
+        "is_domestic": "domestic" in qid_l,
+        "is_category": "category" in qid_l,
+        "is_product_segment": "product_segment" in qid_l,
+        "is_state_scoped": "by_state" in qid_l or "state_category" in qid_l,
+        "is_cso_scoped": "by_cso" in qid_l or "cso_category" in qid_l,
+    }
+
+
+# Family → flag a template must have (STATE and GENERAL have no required flag)
+FAMILY_REQUIRED_FLAG = {
+    "CSO": "is_cso",
+    "PRODUCT": "is_product",
+    "EXPORT": "is_export",
+    "DOMESTIC": "is_domestic",
+    "CATEGORY": "is_category",
+}
+
+
+def family_where_filter(family: str, mentions_state: bool, mentions_export: bool, mentions_cso: bool) -> Optional[Dict[str, Any]]:
+    """Chroma `where` clause for the templates a routed family may pick from (None = all)."""
+    conditions = []
+    if family in FAMILY_REQUIRED_FLAG:
+        conditions.append({FAMILY_REQUIRED_FLAG[family]: True})
+
+    # GENERAL family: exclude specialized queries that require specific filters
+    if family == "GENERAL":
+        # Exclude product_segment queries (those are for PRODUCT family)
+        conditions.append({"is_product_segment": False})
+        # Exclude state-specific queries unless user mentioned a state
+        if not mentions_state:
+            conditions.append({"is_state_scoped": False})
+        # Exclude CSO-specific queries unless user mentioned CSO
+        if not mentions_cso:
+            conditions.append({"is_cso_scoped": False})
+
+    # Prefer domestic over export unless explicitly mentioned
+    if family == "PRODUCT" and not mentions_export:
+        conditions.append({"is_export": False})
+
+    if not conditions:
+        return None
+    return conditions[0] if len(conditions) == 1 else {"$and": conditions}
+
+# --- Template index: every stored template embedding as one (N, dim) matrix ---
+# The store holds a few dozen templates, so nearest-neighbour search is a single
+# matrix-vector product in NumPy rather than a Chroma query per question.
+_TEMPLATE_MATRIX: Optional[np.ndarray] = None  # (N, dim) unit vectors
+_TEMPLATE_IDS: List[str] = []
+_TEMPLATE_FLAGS: Dict[str, np.ndarray] = {}  # family flag → (N,) bool column
+_TEMPLATE_LOCK = Lock()
+
+
+def _load_template_index():
+    """(Re)loads the template embeddings and family flags from the store."""
+    global _TEMPLATE_MATRIX, _TEMPLATE_IDS, _TEMPLATE_FLAGS
+    stored = _collection().get(include=["embeddings", "metadatas"])
+    ids = list(stored["ids"])
+    if ids:
+        matrix = np.asarray(stored["embeddings"], dtype=np.float32).reshape(len(ids), -1)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix /= np.where(norms == 0, 1.0, norms)
+    else:
+        # Empty store (just force-deleted, or an empty query file): searches fail with "Routing failed"
+        matrix = np.empty((0, 0), dtype=np.float32)
+    # Family flags come from the metadata written at seeding; templates stored without
+    # them (seeded elsewhere) get them derived from their ID
+    flag_rows = [
+        {**query_family_flags(query_id), **(meta or {})}
+        for query_id, meta in zip(ids, stored["metadatas"] or [None] * len(ids))
+    ]
+    flags = {
+        flag: np.fromiter((row[flag] for row in flag_rows), dtype=bool, count=len(ids))
+        for flag in query_family_flags("")
+    }
+    with _TEMPLATE_LOCK:
+        _TEMPLATE_MATRIX, _TEMPLATE_IDS, _TEMPLATE_FLAGS = matrix, ids, flags
+    print(f"[DEBUG] Loaded {len(ids)} template embeddings for routing")
+
+
+def _template_index() -> Tuple[np.ndarray, List[str], Dict[str, np.ndarray]]:
+    if _TEMPLATE_MATRIX is None:
+        _load_template_index()
+    with _TEMPLATE_LOCK:
+        return _TEMPLATE_MATRIX, _TEMPLATE_IDS, _TEMPLATE_FLAGS
+
+
+def _where_mask(where: Optional[Dict[str, Any]], flags: Dict[str, np.ndarray], size: int) -> np.ndarray:
+    """Evaluates a family_where_filter clause over the flag columns."""
+    mask = np.ones(size, dtype=bool)
+    if where is None:
+        return mask
+    for condition in where.get("$and", [where]):
+        for flag, wanted in condition.items():
+            mask &= flags[flag] == wanted
+    return mask
+
+
+def clear_template_index():
+    global _TEMPLATE_MATRIX, _TEMPLATE_IDS, _TEMPLATE_FLAGS
+    with _TEMPLATE_LOCK:
+        _TEMPLATE_MATRIX, _TEMPLATE_IDS, _TEMPLATE_FLAGS = None, [], {}
+
+
+# --- Route cache: question → chosen query ID ---
+# Exact hits are keyed on the normalized question; near-duplicates are found by
+# cosine similarity over the stored question embeddings. Only the query ID is
+# cached: the template itself always comes from get_query_by_id.
+ROUTE_CACHE_SIZE = 512
+ROUTE_CACHE_TTL_SECONDS = 600
+ROUTE_CACHE_MIN_SIMILARITY = 0.97
+
+_ROUTE_EXACT: "OrderedDict[Tuple, Tuple[float, str]]" = OrderedDict()
+_ROUTE_SEM_KEYS: Optional[np.ndarray] = None  # (N, dim) unit vectors
+_ROUTE_SEM_VALS: List[Tuple[float, Tuple, str]] = []  # (stored_at, signature, query_id) per row
+_ROUTE_LOCK = Lock()
+
+
+def _route_cache_lookup(exact_key: Tuple, signature: Tuple, query_vector: Optional[np.ndarray]) -> Optional[str]:
+    """
+    Cached query ID for this question, or None.
+    A semantic hit also needs the same signature (family hint and the state /
+    export / CSO mentions), since those steer routing beyond wording.
+    """
+    now = monotonic()
+    with _ROUTE_LOCK:
+        entry = _ROUTE_EXACT.get(exact_key)
+        if entry is not None:
+            if now - entry[0] <= ROUTE_CACHE_TTL_SECONDS:
+                _ROUTE_EXACT.move_to_end(exact_key)
+                return entry[1]
+            del _ROUTE_EXACT[exact_key]
+
+        if query_vector is None or _ROUTE_SEM_KEYS is None:
+            return None
+        scores = _ROUTE_SEM_KEYS @ query_vector
+        for row in np.argsort(scores)[::-1]:
+            if scores[row] < ROUTE_CACHE_MIN_SIMILARITY:
+                break
+            stored_at, cached_signature, query_id = _ROUTE_SEM_VALS[row]
+            if cached_signature == signature and now - stored_at <= ROUTE_CACHE_TTL_SECONDS:
+                return query_id
+    return None
+
+
+def _route_cache_store(exact_key: Tuple, signature: Tuple, query_vector: np.ndarray, query_id: str):
+    global _ROUTE_SEM_KEYS
+    now = monotonic()
+    with _ROUTE_LOCK:
+        _ROUTE_EXACT[exact_key] = (now, query_id)
+        _ROUTE_EXACT.move_to_end(exact_key)
+        if len(_ROUTE_EXACT) > ROUTE_CACHE_SIZE:
+            _ROUTE_EXACT.popitem(last=False)
+
+        row = query_vector[None, :]
+        _ROUTE_SEM_KEYS = row if _ROUTE_SEM_KEYS is None else np.vstack((_ROUTE_SEM_KEYS[-(ROUTE_CACHE_SIZE - 1):], row))
+        _ROUTE_SEM_VALS.append((now, signature, query_id))
+        del _ROUTE_SEM_VALS[:-ROUTE_CACHE_SIZE]
+
+
+def _route_cache_evict(query_id: str):
+    """Drops every cached route to query_id (e.g. a template removed by a re-seed)."""
+    global _ROUTE_SEM_KEYS
+    with _ROUTE_LOCK:
+        for key in [key for key, (_, cached_id) in _ROUTE_EXACT.items() if cached_id == query_id]:
+            del _ROUTE_EXACT[key]
+        keep = [row for row, (_, _, cached_id) in enumerate(_ROUTE_SEM_VALS) if cached_id != query_id]
+        if len(keep) != len(_ROUTE_SEM_VALS):
+            _ROUTE_SEM_KEYS = _ROUTE_SEM_KEYS[keep] if keep else None
+            _ROUTE_SEM_VALS[:] = [_ROUTE_SEM_VALS[row] for row in keep]
+
+
+def clear_route_cache():
+    global _ROUTE_SEM_KEYS
+    with _ROUTE_LOCK:
+        _ROUTE_EXACT.clear()
+        _ROUTE_SEM_KEYS = None
+        _ROUTE_SEM_VALS.clear()
+
+
+def _embed_query(user_query: str) -> np.ndarray:
+    """Unit-length embedding of the question, shared by the route cache and template search."""
+    query_vector = np.asarray(EMBEDDINGS([user_query])[0], dtype=np.float32)
+    query_vector /= np.linalg.norm(query_vector) or 1.0
+    return query_vector
+
+
+def semantic_search_sql(user_query: str, k: int = 1, family: str = None) -> Tuple[str, str, List[str], List[str], Dict[str, Any]]:
+    """
+    Routes the question to a query family, then picks the closest template in it.
+    A family already labelled upstream (the context analyzer's query_family) is
+    used as-is; the router LLM only runs when it is missing or unrecognised.
+    """
+    q_lower = " " + user_query.lower() + " "
 
-    finally:
+    mentions_state = bool(STATE_MENTION_PATTERN.search(q_lower))
+    mentions_export = "export" in q_lower
+    mentions_cso = bool(CSO_MENTION_PATTERN.search(q_lower))
+
+    # 0️⃣ Route cache: same or near-identical question → same template, no LLM or search
+    family = (family or "").strip().upper()
+    signature = (family, k, mentions_state, mentions_export, mentions_cso)
+    exact_key = (" ".join(q_lower.split()),) + signature
+    cached_id = _route_cache_lookup(exact_key, signature, None)
+    query_vector = None
+    if cached_id is None:
+        query_vector = _embed_query(user_query)
+        cached_id = _route_cache_lookup(exact_key, signature, query_vector)
+    if cached_id is not None:
         try:
-            CHROMA_CLIENT.delete_collection(temp_name)
-        except:
-            pass
+            result = get_query_by_id(cached_id)
+            print(f"[DEBUG] Route cache hit (ID: {cached_id})")
+            return result
+        except ValueError:
+            # Template no longer in the store: forget it and route afresh
+            _route_cache_evict(cached_id)
+            if query_vector is None:
+                query_vector = _embed_query(user_query)
 
-    if not results or not results["metadatas"][0]:
+    # 1️⃣ LLM Routing
+    if family in ROUTER_FAMILIES:
+        print(f"[DEBUG] Query Family (from context analysis): {family}")
+    else:
+        family = ROUTER_CHAIN.invoke({"question": user_query}).strip().upper()
+        print(f"[DEBUG] LLM Query Family: {family}")
+
+    # 2️⃣ Nearest template within the family: cosine similarity against the template index
+    where = family_where_filter(family, mentions_state, mentions_export, mentions_cso)
+    matrix, template_ids, flags = _template_index()
+    if not template_ids:
         raise ValueError("Routing failed: No SQL query selected")
 
-    match = results["metadatas"][0][0]
-    query_id = results["ids"][0][0]
+    allowed = np.flatnonzero(_where_mask(where, flags, len(template_ids)))
+    # Nothing in the family matched: search the whole store, as before
+    if allowed.size == 0:
+        allowed = np.arange(len(template_ids))
+    # Reuse the embedding computed for the route cache instead of embedding the text again
+    best = allowed[np.argmax(matrix[allowed] @ query_vector)]
+    query_id = template_ids[best]
 
-    sql = match["sql_query"]
-    params = json.loads(match.get("parameters", "[]"))
-    optional = json.loads(match.get("optional_parameters", "[]"))
-    defaults = json.loads(match.get("defaults", "{}"))
+    _, sql, params, optional, defaults = get_query_by_id(query_id)
 
     print(f"[DEBUG] Semantic Match (ID: {query_id})")
     print(f"[DEBUG] Required params: {params}")
     print(f"[DEBUG] Optional params: {optional}")
 
+    _route_cache_store(exact_key, signature, query_vector, query_id)
     return query_id, sql, params, optional, defaults
 
 def force_delete_all_queries():
@@ -275,15 +608,17 @@ def force_delete_all_queries():
     Deletes ALL documents in the sql_query_store collection.
     Used for forced manual re-seeding.
     """
+    global _QUERY_COLLECTION
     try:
-        collection = CHROMA_CLIENT.get_collection(
-            name=COLLECTION_NAME,
-            embedding_function=EMBEDDINGS
-        )
-
-        count_before = collection.count()
-        collection.delete(where={"sql_query": {"$ne": "NEVER_MATCH"}})
-        count_after = collection.count()
+        count_before = _collection().count()
+        # Dropping the collection discards its index wholesale instead of a filtered row-by-row delete
+        CHROMA_CLIENT.delete_collection(name=COLLECTION_NAME)
+        _QUERY_COLLECTION = None
+        count_after = _collection().count()  # recreated empty, bound to EMBEDDINGS
+        _load_query.cache_clear()
+        _QUERY_REGISTRY.clear()
+        clear_route_cache()
+        clear_template_index()
 
         print(f"SUCCESS: Deleted {count_before - count_after} entities from ChromaDB collection '{COLLECTION_NAME}'.")
 
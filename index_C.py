@@ -1,6 +1,6 @@
 import os
 import pyodbc
-import json
+import orjson
 
 from db import initialize_vector_db, force_delete_all_queries
 from agent import run_sql_rag_agent
@@ -80,9 +80,9 @@ def main_chat_interface():
         response_json_str = run_sql_rag_agent(user_question, CONNECTION_STRING, chat_state)
         
         try:
-            response_dict = json.loads(response_json_str)
+            response_dict = orjson.loads(response_json_str)
             print(f"🤖 Agent: {response_dict.get('bot_answer', 'Error parsing response')}")
-        except json.JSONDecodeError:
+        except orjson.JSONDecodeError:
             print(f"🤖 Agent: {response_json_str}")
 
 
@@ -0,0 +1,85 @@
+from datetime import date, timedelta
+from functools import lru_cache
+from typing import NamedTuple
+
+
+def calculate_date_from_placeholder(placeholder: str) -> str:
+    """
+    Converts date placeholder tokens to actual YYYY-MM-DD dates.
+   
+    Placeholders:
+    - __LAST_MONTH_START__: First day of last month
+    - __LAST_MONTH_END__: Last day of last month
+    - __THIS_MONTH_START__: First day of current month
+    - __THIS_MONTH_END__: Last day of current month
+    - __LAST_QUARTER_START__: First day of last quarter
+    - __LAST_QUARTER_END__: Last day of last quarter
+    """
+    field = PLACEHOLDER_DATE_FIELDS.get(placeholder)
+    if field is None:
+        # If not a placeholder, return as-is
+        return placeholder
+    return getattr(get_date_context(date.today()), field)
+
+
+class DateContext(NamedTuple):
+    """Relative-period boundaries (YYYY-MM-DD) for one calendar day."""
+    today: date
+    last_month_start: str
+    last_month_end: str
+    this_month_start: str
+    this_month_end: str
+    last_quarter_start: str
+    last_quarter_end: str
+    this_year_start: str
+    this_year_end: str
+    last_year_start: str
+    last_year_end: str
+
+
+# Date placeholder token → DateContext field
+PLACEHOLDER_DATE_FIELDS = {
+    "__LAST_MONTH_START__": "last_month_start",
+    "__LAST_MONTH_END__": "last_month_end",
+    "__THIS_MONTH_START__": "this_month_start",
+    "__THIS_MONTH_END__": "this_month_end",
+    "__LAST_QUARTER_START__": "last_quarter_start",
+    "__LAST_QUARTER_END__": "last_quarter_end",
+}
+
+
+@lru_cache(maxsize=1)
+def get_date_context(today: date) -> DateContext:
+    """
+    Computes every relative date the agent uses, once per calendar day.
+    Shared by placeholder defaults and the date phrases in extract_from_original_question.
+    """
+    first_of_this_month = today.replace(day=1)
+    last_of_last_month = first_of_this_month - timedelta(days=1)
+    
+    next_month = today.replace(day=28) + timedelta(days=4)
+    last_of_this_month = next_month - timedelta(days=next_month.day)
+    
+    current_quarter = (today.month - 1) // 3
+    if current_quarter == 0:
+        # Last quarter is Q4 of previous year
+        last_q_start = date(today.year - 1, 10, 1)
+        last_q_end = date(today.year - 1, 12, 31)
+    else:
+        last_q_start = date(today.year, (current_quarter - 1) * 3 + 1, 1)
+        last_q_end = date(today.year, current_quarter * 3, 28) + timedelta(days=4)
+        last_q_end = last_q_end - timedelta(days=last_q_end.day)
+    
+    return DateContext(
+        today=today,
+        last_month_start=last_of_last_month.replace(day=1).strftime("%Y-%m-%d"),
+        last_month_end=last_of_last_month.strftime("%Y-%m-%d"),
+        this_month_start=first_of_this_month.strftime("%Y-%m-%d"),
+        this_month_end=last_of_this_month.strftime("%Y-%m-%d"),
+        last_quarter_start=last_q_start.strftime("%Y-%m-%d"),
+        last_quarter_end=last_q_end.strftime("%Y-%m-%d"),
+        this_year_start=f"{today.year}-01-01",
+        this_year_end=f"{today.year}-12-31",
+        last_year_start=f"{today.year - 1}-01-01",
+        last_year_end=f"{today.year - 1}-12-31",
+    )
@@ -1,18 +1,25 @@
-from typing import Dict, Any, List
-from pydantic import BaseModel, Field
+import json
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Deque, Dict, Any, List, Optional
 from datetime import datetime
 
-class ChatState(BaseModel):
+from schemas.dates import calculate_date_from_placeholder
+
+@dataclass(slots=True)
+class ChatState:
     """
     Represents the persistent state of the conversation, 
     used to manage multi-turn queries and parameter collection.
+    Internal state only (never built from user input), so a slotted dataclass
+    rather than a validated model.
     """
     
     # --- Parameter Collection State ---
     pending_query_id: str = ""
     last_query_template: str = ""
-    missing_params: List[str] = Field(default_factory=list)
-    collected_params: Dict[str, Any] = Field(default_factory=dict)
+    missing_params: List[str] = field(default_factory=list)
+    collected_params: Dict[str, Any] = field(default_factory=dict)
     original_question: str = ""
     
     # --- Loop Prevention ---
@@ -20,26 +27,40 @@ class ChatState(BaseModel):
     MAX_PARAM_ATTEMPTS: int = 3
     
     # --- Optional Parameters Tracking ---
-    optional_params: List[str] = Field(default_factory=list)
-    param_defaults: Dict[str, Any] = Field(default_factory=dict)
+    optional_params: List[str] = field(default_factory=list)
+    param_defaults: Dict[str, Any] = field(default_factory=dict)
 
     # --- Result Recall State (For 'Show Table' follow-up) ---
-    last_columns: List[str] = Field(default_factory=list)
-    last_rows: List[List[Any]] = Field(default_factory=list)
+    last_columns: List[str] = field(default_factory=list)
+    last_rows: List[List[Any]] = field(default_factory=list)
     
     # ========================================
     # Conversation Memory Fields (NEW)
     # ========================================
-    conversation_history: List[Dict[str, Any]] = Field(default_factory=list)
-    last_successful_params: Dict[str, Any] = Field(default_factory=dict)
+    conversation_history: Deque[Dict[str, Any]] = field(default_factory=deque)
+    last_successful_params: Dict[str, Any] = field(default_factory=dict)
     last_query_context: str = ""
     last_query_id: str = ""
     last_executed_sql: str = ""  # Store last SQL for month-wise breakdown
     last_sort_direction: str = "DESC"  # Track sort direction for clarification questions
-    last_filter_params: Dict[str, Any] = Field(default_factory=dict)  # Persistent filter params (state_id, business_category, etc.)
+    last_filter_params: Dict[str, Any] = field(default_factory=dict)  # Persistent filter params (state_id, business_category, etc.)
     
     MAX_HISTORY_TURNS: int = 5
     
+    # json.dumps(last_successful_params), built on first use; reset wherever the dict is replaced
+    _last_params_json: Optional[str] = field(default=None, init=False, repr=False, compare=False)
+    # get_history_for_llm line for each conversation_history entry, rendered once in add_turn.
+    # Both caches assume conversation_history only changes through add_turn / clear_all.
+    _history_lines: Deque[str] = field(default_factory=deque, init=False, repr=False, compare=False)
+    # get_history_for_llm result, joined on first use; reset whenever the history changes
+    _history_text: Optional[str] = field(default=None, init=False, repr=False, compare=False)
+    
+    def __post_init__(self):
+        # Bounded to MAX_HISTORY_TURNS * 2 messages: appends past the cap evict the oldest in O(1)
+        max_messages = self.MAX_HISTORY_TURNS * 2
+        self.conversation_history = deque(self.conversation_history, maxlen=max_messages)
+        self._history_lines = deque(map(self._format_turn, self.conversation_history), maxlen=max_messages)
+    
     def increment_attempts(self) -> bool:
         """
         Increments attempt counter and returns True if should continue,
@@ -57,23 +78,24 @@ class ChatState(BaseModel):
         Adds a conversation turn (user or assistant) to history.
         Keeps only the last MAX_HISTORY_TURNS * 2 messages.
         """
-        self.conversation_history.append({
+        turn = {
             "role": role,
             "message": message,
             "params": params or {},
             "timestamp": datetime.now().isoformat()
-        })
-        # Keep only last N turns (each turn = user + assistant)
-        max_messages = self.MAX_HISTORY_TURNS * 2
-        if len(self.conversation_history) > max_messages:
-            self.conversation_history = self.conversation_history[-max_messages:]
+        }
+        # Keep only last N turns (each turn = user + assistant); the deques drop the oldest
+        self.conversation_history.append(turn)
+        self._history_lines.append(self._format_turn(turn))
+        self._history_text = None
     
     def save_successful_query(self, params: Dict[str, Any], question: str, query_id: str):
         """
         Stores the parameters and context of the last successfully executed query.
         Called after SQL execution succeeds.
         """
-        self.last_successful_params = params.copy()
+        self.last_successful_params = dict(params)
+        self._last_params_json = None
         self.last_query_context = question
         self.last_query_id = query_id
         self.last_sort_direction = params.get('sort', 'DESC')
@@ -90,18 +112,26 @@ class ChatState(BaseModel):
         if not self.conversation_history:
             return "No previous conversation."
         
-        formatted = []
-        for turn in self.conversation_history[-10:]:
-            role = turn["role"].upper()
-            msg = turn["message"][:300]  # Truncate long messages
-            params = turn.get("params", {})
-            
-            if params:
-                formatted.append(f"{role}: {msg}\n   [Params: {params}]")
-            else:
-                formatted.append(f"{role}: {msg}")
+        if self._history_text is None:
+            self._history_text = "\n".join(self._history_lines)
+        return self._history_text
+    
+    @staticmethod
+    def _format_turn(turn: Dict[str, Any]) -> str:
+        """Renders one history entry the way get_history_for_llm shows it."""
+        role = turn["role"].upper()
+        msg = turn["message"][:300]  # Truncate long messages
+        params = turn.get("params", {})
         
-        return "\n".join(formatted)
+        if params:
+            return f"{role}: {msg}\n   [Params: {params}]"
+        return f"{role}: {msg}"
+    
+    def get_last_params_json(self) -> str:
+        """Returns last_successful_params as JSON, serialized once per successful query."""
+        if self._last_params_json is None:
+            self._last_params_json = json.dumps(self.last_successful_params)
+        return self._last_params_json
     
     def has_context(self) -> bool:
         """Returns True if there is previous successful query context."""
@@ -132,8 +162,11 @@ class ChatState(BaseModel):
         self.clear_query_state()
         self.clear_result_state()
         # Also clear conversation memory
-        self.conversation_history = []
+        self.conversation_history.clear()
+        self._history_lines.clear()
+        self._history_text = None
         self.last_successful_params = {}
+        self._last_params_json = None
         self.last_query_context = ""
         self.last_query_id = ""
         self.last_executed_sql = ""
@@ -145,8 +178,6 @@ class ChatState(BaseModel):
         Applies default values to any missing optional parameters.
         Returns updated list of truly missing (required) parameters.
         """
-        from datetime import datetime, timedelta
-        
         truly_missing = []
         
         for param in self.missing_params:
@@ -155,24 +186,8 @@ class ChatState(BaseModel):
                 
                 # Calculate date placeholders
                 if isinstance(default_value, str) and default_value.startswith("__") and default_value.endswith("__"):
-                    today = datetime.now()
-                    
-                    if default_value == "__LAST_MONTH_START__":
-                        first_of_last_month = (today.replace(day=1) - timedelta(days=1)).replace(day=1)
-                        default_value = first_of_last_month.strftime("%Y-%m-%d")
-                    
-                    elif default_value == "__LAST_MONTH_END__":
-                        first_of_this_month = today.replace(day=1)
-                        last_of_last_month = first_of_this_month - timedelta(days=1)
-                        default_value = last_of_last_month.strftime("%Y-%m-%d")
-                    
-                    elif default_value == "__THIS_MONTH_START__":
-                        default_value = today.replace(day=1).strftime("%Y-%m-%d")
-                    
-                    elif default_value == "__THIS_MONTH_END__":
-                        next_month = today.replace(day=28) + timedelta(days=4)
-                        last_of_this_month = next_month - timedelta(days=next_month.day)
-                        default_value = last_of_this_month.strftime("%Y-%m-%d")
+                    # Same per-day date context the agent uses (computed once per day)
+                    default_value = calculate_date_from_placeholder(default_value)
                 
                 # Apply the calculated/regular default
                 self.collected_params[param] = default_value
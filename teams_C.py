@@ -6,15 +6,23 @@ load_dotenv()
 
 import uvicorn
 import requests
+from requests.adapters import HTTPAdapter
 import asyncio
 from fastapi import FastAPI, Request
 import json
+import logging
+import orjson
 import pytz
+from collections import OrderedDict
 from datetime import datetime, timedelta
+from time import monotonic
 from typing import Dict, Any
 from schemas.state import ChatState
 from agent import run_sql_rag_agent
 
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"))
+logger = logging.getLogger(__name__)
+
 # --- MS Fabric Connection ---
 USER_ID = os.getenv("FABRIC_DB_USER")
 PASSWORD = os.getenv("FABRIC_DB_PASSWORD")
@@ -39,11 +47,23 @@ Tenant_ID = os.getenv("TEAMS_TENANT_ID")
 # --- Global State ---
 token_expiry_ist: datetime | None = None
 TOKEN_LIFETIME = 1  # Hours
+TOKEN_REFRESH_MARGIN = timedelta(minutes=5)  # refresh early so no request hits the expiry edge
 bot_token: str | None = None
+token_lock = asyncio.Lock()
+background_tasks: set = set()  # strong refs so fire-and-forget tasks (typing indicator) are not collected
 conversation_store: Dict[str, Any] = {}
 last_message_id_store: Dict[str, str] = {}
-agent_states: Dict[str, ChatState] = {}
+agent_states: "OrderedDict[str, ChatState]" = OrderedDict()  # least recently active first
 MAX_MESSAGES = 10
+MAX_CONVERSATIONS = 500  # idle conversations beyond this are dropped, oldest first
+CONVERSATION_IDLE_SECONDS = 3600  # conversations silent this long are dropped too
+conversation_last_active: Dict[str, float] = {}
+
+# --- Outbound HTTP ---
+# One keep-alive session for Bot Framework / login calls, so each message reuses
+# warm TLS connections instead of handshaking for the token, typing and reply posts
+http_session = requests.Session()
+http_session.mount("https://", HTTPAdapter(pool_connections=8, pool_maxsize=32))
 
 # --- Initialize ChromaDB at startup ---
 from db import initialize_vector_db
@@ -64,7 +84,7 @@ async def get_bot_token():
         "client_secret": MICROSOFT_APP_PASSWORD,
         "scope": "https://api.botframework.com/.default"
     }
-    response = await asyncio.to_thread(requests.post, url, data=data)
+    response = await asyncio.to_thread(http_session.post, url, data=data)
     
     resp_json = response.json()
     if "access_token" not in resp_json:
@@ -90,11 +110,31 @@ async def send_typing_indicator(service_url: str, conv_id: str, token: str, body
     }
     
     try:
-        await asyncio.to_thread(requests.post, api_url, headers=headers, json=payload, timeout=2)
+        await asyncio.to_thread(http_session.post, api_url, headers=headers, data=orjson.dumps(payload), timeout=2)
     except Exception as e:
         print(f"[WARNING] Typing indicator failed: {e}")
 
 
+# --- Bound Per-Conversation Memory ---
+def evict_idle_conversations():
+    """
+    Drops the least recently active conversations while more than
+    MAX_CONVERSATIONS are held or they have been idle CONVERSATION_IDLE_SECONDS.
+    agent_states is kept in activity order, so only the oldest entries are checked.
+    """
+    now = monotonic()
+    while agent_states:
+        conv_id = next(iter(agent_states))
+        idle = now - conversation_last_active.get(conv_id, now)
+        if len(agent_states) <= MAX_CONVERSATIONS and idle < CONVERSATION_IDLE_SECONDS:
+            break
+        del agent_states[conv_id]
+        conversation_last_active.pop(conv_id, None)
+        conversation_store.pop(conv_id, None)
+        last_message_id_store.pop(conv_id, None)
+        print(f"[DEBUG] Evicted idle conversation: {conv_id}")
+
+
 # --- Format Response for Teams ---
 def format_teams_message(text: str) -> str:
     """
@@ -116,10 +156,9 @@ async def messages(request: Request):
     global token_expiry_ist, bot_token, agent_states, last_message_id_store, conversation_store
     
     body = await request.json()
-    print("\n" + "="*60)
-    print("INCOMING TEAMS MESSAGE")
-    print("="*60)
-    print(json.dumps(body, indent=2)[:500])
+    # Only pay for pretty-printing the activity when debug logging is on (LOG_LEVEL=DEBUG)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("INCOMING TEAMS MESSAGE\n%s", json.dumps(body, indent=2)[:500])
 
     conv_id = body["conversation"]["id"]
     message_id = body.get("id")
@@ -143,8 +182,12 @@ async def messages(request: Request):
     if conv_id not in agent_states:
         agent_states[conv_id] = ChatState()
         print(f"[DEBUG] New ChatState initialized for conversation: {conv_id}")
+    else:
+        agent_states.move_to_end(conv_id)
+    conversation_last_active[conv_id] = monotonic()
     
     current_chat_state = agent_states[conv_id]
+    evict_idle_conversations()
     
     # Store conversation history
     if conv_id not in conversation_store:
@@ -167,19 +210,28 @@ async def messages(request: Request):
     ist = pytz.timezone("Asia/Kolkata")
     now_ist = datetime.now(ist)
     
-    if token_expiry_ist is None or now_ist >= token_expiry_ist:
-        bot_token = await get_bot_token()
-        token_expiry_ist = now_ist + timedelta(hours=TOKEN_LIFETIME)
-        print("[TOKEN] New bot token generated")
+    if token_expiry_ist is None or now_ist >= token_expiry_ist - TOKEN_REFRESH_MARGIN:
+        # Only one coroutine refreshes; the rest wait and then reuse its token
+        async with token_lock:
+            if token_expiry_ist is None or now_ist >= token_expiry_ist - TOKEN_REFRESH_MARGIN:
+                bot_token = await get_bot_token()
+                token_expiry_ist = now_ist + timedelta(hours=TOKEN_LIFETIME)
+                print("[TOKEN] New bot token generated")
+            else:
+                print("[TOKEN] Using token refreshed by a concurrent request")
     else:
         print("[TOKEN] Using existing token")
 
     # --- Send Typing Indicator ---
-    # Skip typing indicator for greetings (instant response expected)
+    # Skip typing indicator for greetings (instant response expected); otherwise post it
+    # in the background so it overlaps with the agent instead of running ahead of it
     if user_text.lower() not in ["hi", "hello", "hii", "hey", "start over", "reset"]:
-        await send_typing_indicator(service_url, conv_id, bot_token, body)
+        typing_task = asyncio.create_task(send_typing_indicator(service_url, conv_id, bot_token, body))
+        background_tasks.add(typing_task)
+        typing_task.add_done_callback(background_tasks.discard)
 
     # --- Agent Processing ---
+    # Started only once the token is in hand: if auth fails, chat_state is left untouched
     try:
         print(f"[AGENT] Processing: '{user_text}'")
         print(f"[STATE] Pending query: {current_chat_state.pending_query_id}")
@@ -194,9 +246,9 @@ async def messages(request: Request):
         
         # Parse agent response
         try:
-            agent_json = json.loads(reply_text)
+            agent_json = orjson.loads(reply_text)
             reply_text = agent_json.get("bot_answer", "Error: Unparseable response")
-        except json.JSONDecodeError:
+        except orjson.JSONDecodeError:
             # Agent returned plain text (shouldn't happen, but handle it)
             pass
         
@@ -235,7 +287,8 @@ async def messages(request: Request):
     }
 
     try:
-        resp = await asyncio.to_thread(requests.post, api_url, headers=headers, json=payload, timeout=10)
+        # Pre-serialized with orjson; headers already carry Content-Type: application/json
+        resp = await asyncio.to_thread(http_session.post, api_url, headers=headers, data=orjson.dumps(payload), timeout=10)
         print(f"[TEAMS] Response status: {resp.status_code}")
         
         if resp.status_code != 200 and resp.status_code != 201: